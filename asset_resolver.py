@@ -0,0 +1,94 @@
+import logging
+import threading
+
+from itertools import islice
+from typing import Iterable
+from typing import Iterator
+
+import planon
+
+import utils.logger
+
+from concurrency import planon_limiter
+from metrics import metrics
+
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# FUNCTIONS
+# ============================================================
+
+def chunked(iterable: Iterable, chunk_size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def unpack_error(count: int) -> ValueError:
+    # Same errors the (me_asset,) = planon.UsrMEAsset.find(...) unpacking raised per row
+    if count == 0:
+        return ValueError("not enough values to unpack (expected 1, got 0)")
+    else:
+        return ValueError("too many values to unpack (expected 1)")
+
+
+def field_value(value) -> str:
+    return '' if value is None else str(value)
+
+
+# ============================================================
+# ASSET RESOLVER
+# Resolves a chunk of CSV rows to UsrMEAssets with one find on
+# Code and joins the results back to the rows on every match key.
+# match maps Planon field -> CSV column, e.g. {'Code': 'CODE'}
+# ============================================================
+
+class AssetResolver:
+
+    def __init__(self, match: dict, chunk_size: int = 100, key_field: str = 'Code', rate_limiter=None):
+        self.match = match
+        self.chunk_size = chunk_size
+        self.key_field = key_field
+        self.rate_limiter = rate_limiter
+
+        self.api_calls = 0
+        self.lock = threading.Lock()
+
+    def row_key(self, row: dict) -> tuple:
+        return tuple(field_value(row[column]) for column in self.match.values())
+
+    def asset_key(self, asset) -> tuple:
+        return tuple(field_value(getattr(asset, field)) for field in self.match)
+
+    def resolve(self, rows: list) -> Iterator[tuple]:
+        # Yields (row, me_asset, error) in input order, error is set when zero or several assets match
+        key_column = self.match[self.key_field]
+
+        for chunk in chunked(rows, self.chunk_size):
+            asset_filter = {
+                "filter": {
+                    self.key_field: {"in": sorted(set(row[key_column] for row in chunk))},
+                }
+            }
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+
+            with planon_limiter.slot(), metrics.time('usrmeasset_find', 'planon UsrMEAsset.find'):
+                me_assets = planon.UsrMEAsset.find(asset_filter)
+            with self.lock:
+                self.api_calls += 1
+
+            matches = {}
+            for me_asset in me_assets:
+                matches.setdefault(self.asset_key(me_asset), []).append(me_asset)
+
+            for row in chunk:
+                row_matches = matches.get(self.row_key(row), [])
+                if len(row_matches) == 1:
+                    yield row, row_matches[0], None
+                else:
+                    yield row, None, unpack_error(len(row_matches))
@@ -0,0 +1,98 @@
+import json
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+# ============================================================
+# FAKE DARTMOUTH API
+# Local HTTP stand-in for the /jwt login and the paged
+# /facilities/<resource> endpoints used by get_resource_by_query
+# ============================================================
+
+class FakeDartmouthHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body, headers: dict = None):
+        payload = json.dumps(body).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def delay(self) -> bool:
+        profile = self.server.profile
+        time.sleep(max(0.0, random.gauss(profile.latency_ms, profile.jitter_ms)) / 1000)
+        return random.random() < profile.error_rate
+
+    def do_POST(self):
+        if self.delay():
+            return self.send_json(503, {'error': 'unavailable'})
+
+        scopes = parse_qs(urlparse(self.path).query).get('scope', [''])[0]
+        self.send_json(200, {'jwt': 'fake-jwt', 'accepted_scopes': scopes.split(' ')})
+
+    def do_GET(self):
+        self.server.count_request()
+        if self.delay():
+            return self.send_json(503, {'error': 'unavailable'})
+
+        url = urlparse(self.path)
+        resource = url.path.rstrip('/').rsplit('/', 1)[-1]
+        documents = self.server.resources.get(resource)
+        if documents is None:
+            return self.send_json(404, {'error': 'not found'})
+
+        query = parse_qs(url.query)
+        page_size = min(int(query.get('pagesize', ['1000'])[0]), self.server.profile.page_size)
+        page = int(query.get('page', ['1'])[0])
+
+        start = (page - 1) * page_size
+        headers = {'x-total-count': str(len(documents)), 'x-request-id': 'fake-continuation-key'}
+        self.send_json(200, documents[start:start + page_size], headers)
+
+
+class FakeDartmouthServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, profile, resources: dict):
+        super().__init__(('127.0.0.1', 0), FakeDartmouthHandler)
+        self.profile = profile
+        self.resources = resources
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def synthetic_resources(property_count: int, spaces_per_property: int) -> dict:
+    properties = [{'id': str(number).zfill(4)} for number in range(1, property_count + 1)]
+    spaces = [
+        {'property_id': prop['id'], 'number': str(100 + room)}
+        for prop in properties
+        for room in range(spaces_per_property)
+    ]
+    return {'properties': properties, 'spaces': spaces}
@@ -0,0 +1,170 @@
+import random
+import sys
+import threading
+import time
+import types
+
+from collections import defaultdict
+
+# ============================================================
+# FAKE PLANON SDK
+# In-process stand-in for the planon REST SDK (Property, Space,
+# UsrMEAsset, ItemGroup find/save). Calls sleep for the profile's
+# latency, fail at its error rate and pay one round-trip per page
+# of results, and every call is recorded for the report.
+# ============================================================
+
+class Profile:
+
+    def __init__(self, latency_ms: float = 20.0, jitter_ms: float = 5.0, error_rate: float = 0.0, page_size: int = 1000):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.page_size = page_size
+
+
+class FakePlanonError(Exception):
+    pass
+
+
+class CallLog:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = defaultdict(int)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint: str, pages: int, seconds: float, failed: bool):
+        with self.lock:
+            self.calls[endpoint] += pages
+            self.latencies[endpoint].append(seconds)
+            if failed:
+                self.errors[endpoint] += 1
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+class Server:
+
+    def __init__(self, profile: Profile):
+        self.profile = profile
+        self.log = CallLog()
+
+    def call(self, endpoint: str, results: int = 1):
+        pages = max(1, -(-results // self.profile.page_size))
+        latency = 0.0
+        for _ in range(pages):
+            latency += max(0.0, random.gauss(self.profile.latency_ms, self.profile.jitter_ms)) / 1000
+
+        started = time.perf_counter()
+        if latency:
+            time.sleep(latency)
+
+        failed = random.random() < self.profile.error_rate
+        self.log.record(endpoint, pages, time.perf_counter() - started, failed)
+
+        if failed:
+            raise FakePlanonError(f"503 Service Unavailable for {endpoint}")
+
+
+server = Server(Profile())
+
+
+class Resource:
+
+    records = []
+    indexes = {}
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    @classmethod
+    def load(cls, records: list):
+        cls.records = records
+        cls.indexes = {}
+
+    @classmethod
+    def index(cls, field: str) -> dict:
+        index = cls.indexes.get(field)
+        if index is None:
+            index = defaultdict(list)
+            for record in cls.records:
+                index[getattr(record, field, None)].append(record)
+            cls.indexes[field] = index
+        return index
+
+    @classmethod
+    def matches(cls, record, field: str, condition: dict) -> bool:
+        value = getattr(record, field, None)
+        if 'eq' in condition:
+            return value == condition['eq']
+        if 'gt' in condition:
+            return value is not None and value > condition['gt']
+        return value in condition['in']
+
+    @classmethod
+    def find(cls, query: dict = None) -> list:
+        query = query or {}
+        conditions = list((query.get('filter') or {}).items())
+
+        if conditions and 'gt' in conditions[0][1]:
+            results = [record for record in cls.records if cls.matches(record, *conditions[0])]
+            for field, condition in conditions[1:]:
+                results = [record for record in results if cls.matches(record, field, condition)]
+        elif conditions:
+            field, condition = conditions[0]
+            index = cls.index(field)
+            values = [condition['eq']] if 'eq' in condition else condition['in']
+            results = [record for value in values for record in index.get(value, [])]
+            for field, condition in conditions[1:]:
+                results = [record for record in results if cls.matches(record, field, condition)]
+        else:
+            results = list(cls.records)
+
+        for field in reversed(query.get('sort') or []):
+            results.sort(key=lambda record: getattr(record, field, None))
+        if query.get('limit'):
+            results = results[:query['limit']]
+
+        server.call(f"{cls.__name__}.find", len(results))
+        return results
+
+    def save(self):
+        server.call(f"{type(self).__name__}.save")
+
+
+class PlanonResource:
+
+    @classmethod
+    def set_site(cls, site: str):
+        pass
+
+    @classmethod
+    def set_header(cls, jwt: str):
+        pass
+
+
+class Property(Resource):
+    pass
+
+
+class Space(Resource):
+    pass
+
+
+class UsrMEAsset(Resource):
+    pass
+
+
+class ItemGroup(Resource):
+    pass
+
+
+def install(profile: Profile) -> types.ModuleType:
+    # Registers this module as `planon` so the importers pick it up
+    server.profile = profile
+    server.log = CallLog()
+    sys.modules['planon'] = sys.modules[__name__]
+    return sys.modules[__name__]
@@ -0,0 +1,228 @@
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import random
+import resource
+import runpy
+import sys
+import tempfile
+import time
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(benchmark_dir)
+sys.path.insert(0, repo_dir)
+
+import fake_planon
+
+from fake_dartmouth import FakeDartmouthServer
+from fake_dartmouth import synthetic_resources
+
+# ============================================================
+# IMPORT BENCHMARK
+# Drives update_asset.py / main.py against the fake Planon SDK
+# with a synthetic CSV and reports throughput, API calls per row,
+# call latency percentiles and peak RSS.
+#
+#   python benchmarks/import_benchmark.py --rows 10000 --workers 8
+#   python benchmarks/import_benchmark.py --dartmouth --spaces 50000
+# ============================================================
+
+columns = {
+    'update_asset': ['CODE', 'ASSET_TAG', 'BUILDING_ID', 'ROOM', 'EQUIPMENT_NUMBER', 'DESCRIPTION', 'CONCATENATION'],
+    'main': ['CODE', 'BUILDING_ID', 'ROOM', 'EQUIP_NUMBER', 'DESCRIPTION'],
+}
+
+rows_per_building = 200
+rooms_per_building = 50
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def generate(path: str, script: str, rows: int, missing_rate: float, nobarcode_rate: float, unchanged_rate: float, compress: bool):
+    # Writes the synthetic CSV and loads the matching records into the fake Planon SDK
+    properties = {}
+    spaces = []
+    assets = []
+
+    opener = gzip.open if compress else open
+    with opener(path, 'wt', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=columns[script])
+        writer.writeheader()
+
+        for number in range(rows):
+            building = str(number // rows_per_building + 1).zfill(4)
+            room = str(100 + number % rooms_per_building)
+
+            if building not in properties:
+                syscode = len(properties) + 1
+                properties[building] = fake_planon.Property(Code=building, Syscode=syscode)
+                for offset in range(rooms_per_building):
+                    spaces.append(fake_planon.Space(Code=str(100 + offset), PropertyRef=syscode, Syscode=syscode * 1000 + offset))
+
+            code = '' if random.random() < nobarcode_rate else str(1000000 + number)
+            row = {
+                'CODE': code,
+                'ASSET_TAG': f"T{number}",
+                'BUILDING_ID': building,
+                'ROOM': room,
+                'EQUIPMENT_NUMBER': f"EQ{number}",
+                'EQUIP_NUMBER': f"EQ{number}",
+                'DESCRIPTION': f"Asset {number}",
+                'CONCATENATION': f"{building}-{room}",
+            }
+            writer.writerow({column: row[column] for column in columns[script]})
+
+            if code and random.random() >= missing_rate:
+                unchanged = random.random() < unchanged_rate
+                assets.append(fake_planon.UsrMEAsset(
+                    Syscode=number + 1,
+                    Code=code,
+                    AssetTag=row['ASSET_TAG'],
+                    Name=row['DESCRIPTION'],
+                    LegacyDescription=row['EQUIPMENT_NUMBER'] if unchanged else None,
+                    Dossier=row['CONCATENATION'] if unchanged else None,
+                ))
+
+    fake_planon.Property.load(list(properties.values()))
+    fake_planon.Space.load(spaces)
+    fake_planon.UsrMEAsset.load(assets)
+    fake_planon.ItemGroup.load([fake_planon.ItemGroup(Name='To be determined', Syscode=1)])
+
+
+def latency_report(call_log) -> dict:
+    endpoints = {}
+    for endpoint, latencies in sorted(call_log.latencies.items()):
+        endpoints[endpoint] = {
+            'calls': call_log.calls[endpoint],
+            'errors': call_log.errors[endpoint],
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        }
+    return endpoints
+
+
+def run_import(args) -> dict:
+    profile = fake_planon.Profile(args.latency_ms, args.jitter_ms, args.error_rate, args.page_size)
+    fake_planon.install(profile)
+
+    os.environ.setdefault('PLANON_API_URL', 'http://fake-planon/')
+    os.environ.setdefault('PLANON_API_KEY', 'fake-key')
+
+    workdir = tempfile.mkdtemp(prefix='import-benchmark-')
+    input_path = os.path.join(workdir, 'load.csv.gz' if args.gzip else 'load.csv')
+    generate(input_path, args.script, args.rows, args.missing_rate, args.nobarcode_rate, args.unchanged_rate, args.gzip)
+    fake_planon.server.log = fake_planon.CallLog()
+
+    script_path = os.path.join(repo_dir, f"{args.script}.py")
+    sys.argv = [script_path, '--input', input_path, '--workers', str(args.workers), '--chunk-size', str(args.chunk_size)] + args.script_args
+
+    os.chdir(workdir)
+    started = time.perf_counter()
+    runpy.run_path(script_path, run_name='__main__')
+    elapsed = time.perf_counter() - started
+
+    call_log = fake_planon.server.log
+    all_latencies = [latency for latencies in call_log.latencies.values() for latency in latencies]
+
+    return {
+        'script': args.script,
+        'rows': args.rows,
+        'workers': args.workers,
+        'chunk_size': args.chunk_size,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(args.rows / elapsed, 1),
+        'api_calls': call_log.total_calls(),
+        'api_calls_per_row': round(call_log.total_calls() / args.rows, 4),
+        'p50_ms': round(percentile(all_latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(all_latencies, 99) * 1000, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'endpoints': latency_report(call_log),
+    }
+
+
+def run_dartmouth(args) -> dict:
+    from utils.dart_api import get_resource_by_query
+
+    profile = fake_planon.Profile(args.latency_ms, args.jitter_ms, args.error_rate, args.page_size)
+    resources = synthetic_resources(max(1, args.spaces // rooms_per_building), rooms_per_building)
+    server = FakeDartmouthServer(profile, resources).start()
+
+    results = {'spaces': len(resources['spaces']), 'runs': {}}
+    for workers in sorted(set([1, args.workers])):
+        server.requests = 0
+        started = time.perf_counter()
+        documents = get_resource_by_query(f"{server.base_url}/facilities/spaces", 'fake-jwt', {}, workers=workers)
+        elapsed = time.perf_counter() - started
+
+        results['runs'][workers] = {
+            'documents': len(documents),
+            'seconds': round(elapsed, 3),
+            'documents_per_second': round(len(documents) / elapsed, 1),
+            'requests': server.requests,
+        }
+
+    server.shutdown()
+    results['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    return results
+
+
+def print_report(report: dict):
+    for key, value in report.items():
+        if isinstance(value, dict):
+            print(f"{key}:")
+            for name, stats in value.items():
+                print(f"  {name}: {stats}")
+        else:
+            print(f"{key}: {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import throughput benchmark against a local fake Planon")
+    parser.add_argument('--script', choices=sorted(columns), default='update_asset')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=100)
+    parser.add_argument('--gzip', action='store_true', help="Feed a gzip compressed CSV")
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--jitter-ms', type=float, default=5.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--missing-rate', type=float, default=0.01, help="Rows with no matching Planon asset")
+    parser.add_argument('--nobarcode-rate', type=float, default=0.01, help="Rows with an empty CODE")
+    parser.add_argument('--unchanged-rate', type=float, default=0.0, help="Rows whose Planon values already match")
+    parser.add_argument('--dartmouth', action='store_true', help="Benchmark get_resource_by_query instead of an import")
+    parser.add_argument('--spaces', type=int, default=20000, help="Spaces served by the fake Dartmouth API")
+    parser.add_argument('--json', help="Also write the report to this file")
+    parser.add_argument('--verbose', action='store_true', help="Keep the importer's INFO logging")
+    parser.add_argument('script_args', nargs=argparse.REMAINDER, help="Extra arguments for the importer after --")
+    args = parser.parse_args()
+    args.script_args = [arg for arg in args.script_args if arg != '--']
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    import utils.logger
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    report = run_dartmouth(args) if args.dartmouth else run_import(args)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
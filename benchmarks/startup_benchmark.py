@@ -0,0 +1,104 @@
+import argparse
+import csv
+import importlib
+import os
+import socket
+import sys
+import tempfile
+import time
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(benchmark_dir)
+sys.path.insert(0, repo_dir)
+
+# ============================================================
+# STARTUP BENCHMARK
+# Times importing the importer modules and parsing the input CSV,
+# and counts outbound connections made while doing so, which
+# should be zero now that setup is lazy.
+#
+#   python benchmarks/startup_benchmark.py --rows 100000
+# ============================================================
+
+modules = [
+    'metrics',
+    'storage',
+    'transport',
+    'columnar',
+    'snapshot_cache',
+    'location_index',
+    'asset_resolver',
+    'fingerprints',
+    'journal',
+    'importer',
+    'staging',
+    'engine',
+    'functions',
+]
+
+connections = []
+
+
+def count_connections():
+    # Records every outbound connection instead of silently allowing it
+    original_connect = socket.socket.connect
+
+    def connect(self, address):
+        connections.append(address)
+        return original_connect(self, address)
+
+    socket.socket.connect = connect
+
+
+def write_csv(path: str, rows: int):
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['CODE', 'ASSET_TAG', 'BUILDING_ID', 'ROOM', 'EQUIPMENT_NUMBER', 'DESCRIPTION', 'CONCATENATION'])
+        for number in range(rows):
+            building = str(number // 200 + 1).zfill(4)
+            writer.writerow([1000000 + number, f"T{number}", building, 100 + number % 50, f"EQ{number}", f"Asset {number}", f"{building}-{100 + number % 50}"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import and input parsing startup benchmark")
+    parser.add_argument('--rows', type=int, default=100000, help="Rows in the synthetic CSV")
+    parser.add_argument('--input', help="Parse this CSV instead of a synthetic one")
+    args = parser.parse_args()
+
+    count_connections()
+
+    print("imports:")
+    started = time.perf_counter()
+    for name in modules:
+        module_started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+            status = 'ok'
+        except ImportError as e:
+            status = f"not importable here ({e})"
+        print(f"  {name}: {(time.perf_counter() - module_started) * 1000:.1f} ms {status}")
+    print(f"  total: {(time.perf_counter() - started) * 1000:.1f} ms")
+    print(f"  connections opened during import: {len(connections)}")
+
+    from importer import read_rows
+
+    path = args.input
+    if not path:
+        path = os.path.join(tempfile.mkdtemp(prefix='startup-benchmark-'), 'load.csv')
+        write_csv(path, args.rows)
+
+    started = time.perf_counter()
+    rows = read_rows(path)
+    next(rows, None)
+    first_row = time.perf_counter() - started
+    count = 1 + sum(1 for _ in rows)
+    elapsed = time.perf_counter() - started
+
+    print("input:")
+    print(f"  first row after: {first_row * 1000:.2f} ms")
+    print(f"  parsed {count} rows in {elapsed * 1000:.1f} ms ({count / elapsed:.0f} rows/sec)")
+    print(f"  connections opened in total: {len(connections)}")
+
+
+if __name__ == '__main__':
+    main()
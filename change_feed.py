@@ -0,0 +1,197 @@
+import argparse
+import logging
+import os
+
+from collections import Counter
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+import utils.logger
+
+from snapshot_cache import SnapshotCache
+from utils.dart_api import delete_resource_change_message
+from utils.dart_api import get_resource_change_messages
+from utils.dart_api import get_resource_document
+from utils.dart_api import login_jwt
+
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# RESOURCE CHANGE FEED
+# Keeps the Dartmouth properties and spaces caches current from the
+# resource change queue instead of re-downloading the full dataset.
+# Each batch of messages is applied to the cache as one delta, in
+# message order so the last change of a record wins, and the
+# messages are deleted from the queue only after the cache is
+# written, so a crash leaves them queued to be applied again.
+#
+# The message format is not documented, assumed here is
+#   {"id": ..., "resource_type": "properties" | "spaces",
+#    "action": "create" | "update" | "delete",
+#    "resource_id": ..., "resource": {...document...}}
+# A message without the document is resolved with a GET of the
+# resource by id, a 404 there is treated as a delete.
+# ============================================================
+
+CREATE_ACTIONS = frozenset(['create', 'created', 'insert', 'add'])
+UPDATE_ACTIONS = frozenset(['update', 'updated', 'modify', 'change'])
+DELETE_ACTIONS = frozenset(['delete', 'deleted', 'remove'])
+
+
+def property_key(document: dict):
+    return document.get('id')
+
+
+def space_key(document: dict):
+    # Spaces are keyed by id when the API provides one, (property_id, number) otherwise
+    if document.get('id') is not None:
+        return document['id']
+    return document.get('property_id'), document.get('number')
+
+
+def parse_change(message: dict) -> Tuple[str, str, str, object, Optional[dict]]:
+    # (message id, resource type, action, resource id, document or None)
+    message_id = message.get('id', message.get('message_id'))
+    resource_type = message.get('resource_type', message.get('resource_name', message.get('type')))
+    action = str(message.get('action', message.get('operation', 'update'))).lower()
+    document = message.get('resource', message.get('document', message.get('data')))
+    resource_id = message.get('resource_id', (document or {}).get('id'))
+
+    if message_id is None or resource_type is None:
+        raise ValueError(f"Unrecognized resource change message {message!r}")
+
+    return str(message_id), str(resource_type).lower(), action, resource_id, document
+
+
+class ChangeFeed:
+
+    def __init__(self, jwt: str, resource_change_url: str, queue_name: str, resource_base_url: str, caches: Dict[str, Tuple[SnapshotCache, Callable]], workers: int = 8):
+        self.jwt = jwt
+        self.resource_change_url = resource_change_url
+        self.queue_name = queue_name
+        self.resource_base_url = resource_base_url
+        self.caches = caches
+        self.workers = workers
+        self.stats = Counter()
+
+    def resolve(self, resource_type: str, action: str, resource_id, document: Optional[dict]):
+        # -> ('upsert' | 'delete', document)
+        if action in DELETE_ACTIONS:
+            return 'delete', document or {'id': resource_id}
+
+        if document is None:
+            document = get_resource_document(self.jwt, f"{self.resource_base_url}/{resource_type}", resource_id)
+            self.stats['documents_fetched'] += 1
+            if document is None:
+                return 'delete', {'id': resource_id}
+
+        return 'upsert', document
+
+    def apply_batch(self, messages: list) -> list:
+        # Applies one batch to the caches, in message order, and returns the ids of the messages that can be deleted
+        changes = defaultdict(list)
+        handled = []
+
+        for message in messages:
+            try:
+                message_id, resource_type, action, resource_id, document = parse_change(message)
+            except ValueError as e:
+                # Left on the queue for a person to look at
+                self.stats['unreadable'] += 1
+                log.error(repr(e))
+                continue
+
+            if resource_type not in self.caches:
+                self.stats['ignored'] += 1
+                handled.append(message_id)
+                continue
+
+            if action not in CREATE_ACTIONS | UPDATE_ACTIONS | DELETE_ACTIONS:
+                self.stats['unreadable'] += 1
+                log.error(f"Unknown action {action!r} in resource change message {message_id}")
+                continue
+
+            kind, document = self.resolve(resource_type, action, resource_id, document)
+            changes[resource_type].append((kind, document))
+            self.stats[f"{resource_type}_{kind}s"] += 1
+            handled.append(message_id)
+
+        for resource_type, resource_changes in changes.items():
+            cache, key = self.caches[resource_type]
+            cache.apply_changes(resource_changes, key)
+
+        return handled
+
+    def acknowledge(self, message_ids: list):
+        # A message whose delete fails is applied again on the next run, which changes nothing
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(delete_resource_change_message, self.jwt, self.resource_change_url, self.queue_name, message_id): message_id for message_id in message_ids}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    self.stats['acknowledged'] += 1
+                except Exception as e:
+                    self.stats['acknowledge_failed'] += 1
+                    log.error(f"Could not delete resource change message {futures[future]}: {repr(e)}")
+
+    def drain(self, batch_size: int = 100, max_batches: int = None) -> Counter:
+        # Reads until the queue is empty, or max_batches batches
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            messages = get_resource_change_messages(self.jwt, self.resource_change_url, self.queue_name, batch_size)
+            if not messages:
+                break
+
+            handled = self.apply_batch(messages)
+            self.acknowledge(handled)
+
+            batches += 1
+            self.stats['messages'] += len(messages)
+
+            # Only unreadable messages left, reading again would return the same ones
+            if not handled:
+                break
+
+        log.info(f"Resource changes : {', '.join(f'{name} {count}' for name, count in sorted(self.stats.items())) or 'none'}")
+        return self.stats
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+def main(argv=None):
+    import functions
+
+    parser = argparse.ArgumentParser(description="Apply Dartmouth property and space changes to the local reference caches")
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--max-batches', type=int, default=None)
+    parser.add_argument('--refresh', nargs='*', choices=sorted(functions.reference_caches), default=None,
+                        help="Reload the named caches (all when none are named) in full instead of reading the change queue")
+    args = parser.parse_args(argv)
+
+    if args.refresh is not None:
+        functions.refresh_reference_data(args.refresh)
+        return
+
+    api_base_url = os.environ.get('API_BASE_URL')
+    jwt = login_jwt(f"{api_base_url}/jwt", os.environ.get("API_KEY"), os.environ.get("RESOURCE_CHANGE_SCOPES", "api:facilities:properties:read"))
+
+    feed = ChangeFeed(
+        jwt,
+        os.environ.get("RESOURCE_CHANGE_URL", f"{api_base_url}/resource_changes"),
+        os.environ.get("RESOURCE_CHANGE_QUEUE"),
+        f"{api_base_url}/facilities",
+        {'properties': (functions.properties_cache, property_key), 'spaces': (functions.spaces_cache, space_key)},
+    )
+    feed.drain(args.batch_size, args.max_batches)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+
+from typing import Iterator
+from typing import List
+
+import planon
+
+import utils.logger
+
+from asset_resolver import AssetResolver
+from asset_resolver import chunked
+from concurrency import planon_limiter
+from importer import ImportStats
+from importer import RateLimiter
+from importer import run_concurrently
+from metrics import metrics
+from snapshot_cache import SnapshotCache
+
+
+log = logging.getLogger(__name__)
+row_log = utils.logger.get_row_logger(__name__)
+
+# ============================================================
+# SNAPSHOTS
+# Full local copies of Planon resources used by the plan phase
+# ============================================================
+
+def planon_snapshot(resource_name: str, fields: List[str], ttl: int) -> SnapshotCache:
+    def loader() -> list:
+        with planon_limiter.slot(), metrics.time('snapshot_find', f"planon {resource_name}.find"):
+            records = getattr(planon, resource_name).find()
+        return [{field: getattr(record, field, None) for field in fields} for record in records]
+
+    return SnapshotCache(f"planon_{resource_name.lower()}", loader, fields=fields, ttl=ttl)
+
+
+# ============================================================
+# CHANGESET FILE
+# One JSON line per asset: {"syscode", "code", "changes": {field: value}}
+# ============================================================
+
+class ChangesetWriter:
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open(path, 'w')
+        self.count = 0
+
+    def write(self, syscode, code: str, changes: dict):
+        self.file.write(json.dumps({'syscode': syscode, 'code': code, 'changes': changes}, separators=(',', ':')) + '\n')
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+        log.info(f"Wrote {self.count} planned changes to {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_changeset(path: str) -> Iterator[dict]:
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+# ============================================================
+# APPLY
+# Re-reads the planned assets by Syscode in chunks and saves only
+# the fields listed in the changeset
+# ============================================================
+
+def apply_changeset(path: str, stats: ImportStats, chunk_size: int = 100, workers: int = 1, rate_limiter: RateLimiter = None):
+    resolver = AssetResolver(match={'Syscode': 'syscode'}, chunk_size=chunk_size, key_field='Syscode', rate_limiter=rate_limiter)
+
+    def apply_chunk(entries: list):
+        try:
+            resolved = list(resolver.resolve(entries))
+        except Exception as e:
+            for entry in entries:
+                stats.fail(entry, e)
+            log.info(f"{repr(e)}")
+            return
+
+        for entry, me_asset, error in resolved:
+            try:
+                if error:
+                    raise error
+
+                for field, value in entry['changes'].items():
+                    setattr(me_asset, field, value)
+
+                if rate_limiter:
+                    rate_limiter.acquire()
+                with planon_limiter.slot(), metrics.time('usrmeasset_save', 'planon UsrMEAsset.save'):
+                    me_asset.save()
+
+                row_log.info("Applied %s to %s", entry['changes'], entry['code'])
+                stats.succeeded(entry)
+            except Exception as e:
+                stats.fail(entry, e)
+                log.info(f"{repr(e)}")
+
+    run_concurrently(chunked(read_changeset(path), chunk_size), apply_chunk, workers=workers)
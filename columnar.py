@@ -0,0 +1,172 @@
+import json
+import logging
+import mmap
+import pickle
+import struct
+import sys
+
+from array import array
+from typing import List
+
+import utils.logger
+
+from storage import write_atomic
+
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'PLNCOL01'
+
+# Code of a None value in a string column
+NULL = 0xFFFFFFFF
+
+# ============================================================
+# FILE LAYOUT
+#   MAGIC | header length (uint32) | JSON header | column blocks
+#
+# Every block starts on an 8 byte boundary, offsets in the header
+# are relative to the end of the header. Column kinds:
+#   str  unique values as one utf-8 blob plus uint32 offsets,
+#        and one uint32 code per record (NULL for None)
+#   int  one int64 per record
+#   obj  pickled list, for anything else
+# Arrays are native byte order, a file from another byte order is
+# treated as unreadable and rebuilt.
+# ============================================================
+
+def align(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def column_kind(values: list) -> str:
+    if all(value is None or type(value) is str for value in values):
+        return 'str'
+    if all(type(value) is int and -2 ** 63 <= value < 2 ** 63 for value in values):
+        return 'int'
+    return 'obj'
+
+
+def encode_column(values: list) -> tuple:
+    # Returns (kind, [blocks]) for one column
+    kind = column_kind(values)
+
+    if kind == 'int':
+        return kind, [array('q', values).tobytes()]
+
+    if kind == 'obj':
+        return kind, [pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL)]
+
+    table = {}
+    codes = array('I', [NULL if value is None else table.setdefault(value, len(table)) for value in values])
+
+    encoded = [value.encode() for value in table]
+    offsets = array('I', [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+
+    return kind, [b''.join(encoded), offsets.tobytes(), codes.tobytes()]
+
+
+def write_columnar(path: str, stamp: dict, created: float, fields: List[str], records: list):
+    columns = list(zip(*records)) if records else [() for _ in fields]
+
+    blocks = []
+    descriptions = []
+    position = 0
+    for field, values in zip(fields, columns):
+        kind, column_blocks = encode_column(list(values))
+        spans = []
+        for block in column_blocks:
+            spans.append([position, len(block)])
+            blocks.append(block + b'\0' * (align(len(block)) - len(block)))
+            position += align(len(block))
+        descriptions.append({'name': field, 'kind': kind, 'blocks': spans})
+
+    header = json.dumps({
+        'stamp': stamp,
+        'created': created,
+        'count': len(records),
+        'byteorder': sys.byteorder,
+        'columns': descriptions,
+    }).encode()
+
+    prefix = MAGIC + struct.pack('<I', len(header)) + header
+    prefix += b'\0' * (align(len(prefix)) - len(prefix))
+    write_atomic(path, prefix + b''.join(blocks))
+
+
+# ============================================================
+# COLUMNAR SNAPSHOT
+# Same interface as snapshot_cache.Snapshot, read through a memory
+# map. A string column decodes each unique value once, records are
+# only built if they are iterated or asked for.
+# ============================================================
+
+class ColumnarSnapshot:
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.map)
+
+        if bytes(self.buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a columnar snapshot")
+
+        header_length, = struct.unpack_from('<I', self.buffer, len(MAGIC))
+        header_start = len(MAGIC) + 4
+        header = json.loads(bytes(self.buffer[header_start:header_start + header_length]))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f"{path} was written with {header['byteorder']} endian arrays")
+
+        self.data_start = align(header_start + header_length)
+        self.stamp = header['stamp']
+        self.created = header['created']
+        self.count = header['count']
+        self.columns = {column['name']: column for column in header['columns']}
+        self.fields = [column['name'] for column in header['columns']]
+
+        self.decoded = {}
+
+    def block(self, field: str, index: int) -> memoryview:
+        offset, length = self.columns[field]['blocks'][index]
+        start = self.data_start + offset
+        return self.buffer[start:start + length]
+
+    def strings(self, field: str) -> list:
+        # Unique values of a string column, indexed by code
+        blob = self.block(field, 0)
+        offsets = self.block(field, 1).cast('I')
+        return [str(blob[offsets[index]:offsets[index + 1]], 'utf-8') for index in range(len(offsets) - 1)]
+
+    def codes(self, field: str) -> memoryview:
+        return self.block(field, 2).cast('I')
+
+    def column(self, field: str) -> list:
+        if field in self.decoded:
+            return self.decoded[field]
+
+        kind = self.columns[field]['kind']
+        if kind == 'int':
+            values = self.block(field, 0).cast('q').tolist()
+        elif kind == 'obj':
+            values = pickle.loads(self.block(field, 0))
+        else:
+            table = self.strings(field)
+            table_get = table.__getitem__
+            values = [None if code == NULL else table_get(code) for code in self.codes(field)]
+
+        self.decoded[field] = values
+        return values
+
+    @property
+    def records(self) -> list:
+        return list(self)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return zip(*(self.column(field) for field in self.fields))
+
+    def dicts(self) -> List[dict]:
+        return [dict(zip(self.fields, record)) for record in self]
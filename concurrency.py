@@ -0,0 +1,135 @@
+import logging
+import re
+import threading
+import time
+
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import requests
+
+import utils.logger
+
+from metrics import metrics
+from transport import retry_statuses
+
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# FUNCTIONS
+# ============================================================
+
+def error_status(error: Exception):
+    # HTTP status behind an exception from requests, zeep or the planon SDK, if there is one
+    for candidate in (getattr(getattr(error, 'response', None), 'status_code', None), getattr(error, 'status_code', None), getattr(error, 'status', None)):
+        if isinstance(candidate, int):
+            return candidate
+
+    match = re.search(r'\b(429|5\d\d)\b', str(error))
+    return int(match.group(1)) if match else None
+
+
+def is_overload(error: Exception) -> bool:
+    if isinstance(error, (requests.Timeout, requests.ConnectionError)):
+        return True
+    return error_status(error) in retry_statuses
+
+
+# ============================================================
+# ADAPTIVE LIMITER
+# AIMD limit on in-flight calls. Each completion at flat latency
+# adds 1/limit (about +1 per round trip of the whole window) while
+# the window is in use. A 429, 5xx, timeout or smoothed latency
+# above tolerance x its long run average halves it, at most once per
+# window of completions so a burst of failures counts once.
+# ============================================================
+
+class AdaptiveLimiter:
+
+    def __init__(self, name: str, initial: int = 4, minimum: int = 1, maximum: int = 64, tolerance: float = 2.0, backoff: float = 0.5, smoothing: float = 0.2, min_spike: float = 0.005):
+        self.name = name
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.min_spike = min_spike
+
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.latency = None
+        self.baseline = None
+        self.completions = 0
+        self.decreases = 0
+
+    def configure(self, initial: int = None, maximum: int = None):
+        with self.condition:
+            if maximum is not None:
+                self.maximum = max(self.minimum, maximum)
+            if initial is not None:
+                self.limit = float(min(max(self.minimum, initial), self.maximum))
+            self.condition.notify_all()
+        self.publish()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, seconds: float, overloaded: bool = False):
+        with self.condition:
+            used = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            self.update(seconds, overloaded, used)
+            self.condition.notify_all()
+        self.publish()
+
+    def update(self, seconds: float, overloaded: bool, used: bool):
+        self.latency = seconds if self.latency is None else self.latency + self.smoothing * (seconds - self.latency)
+
+        # Long run average, a Planon that is slower all day becomes the new normal instead of a spike
+        self.baseline = self.latency if self.baseline is None else self.baseline + self.smoothing / 10 * (self.latency - self.baseline)
+
+        self.completions += 1
+        # Jitter of a few milliseconds on very fast calls is not a spike
+        spike = self.latency > self.baseline * self.tolerance and self.latency - self.baseline > self.min_spike
+        if overloaded or spike:
+            # At most once per window of completions
+            if self.completions >= self.limit:
+                self.limit = max(float(self.minimum), self.limit * self.backoff)
+                self.completions = 0
+                self.decreases += 1
+        elif used:
+            self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+
+    def publish(self):
+        metrics.gauge(f"{self.name}_concurrency_limit", round(self.limit, 2))
+        metrics.gauge(f"{self.name}_in_flight", self.in_flight)
+        metrics.gauge(f"{self.name}_latency_seconds", round(self.latency or 0.0, 6))
+        metrics.gauge(f"{self.name}_baseline_latency_seconds", round(self.baseline or 0.0, 6))
+
+    @contextmanager
+    def slot(self):
+        # Callers that get a response back instead of an exception set call.status
+        call = SimpleNamespace(status=None)
+        overloaded = False
+
+        self.acquire()
+        started = time.perf_counter()
+        try:
+            yield call
+        except Exception as e:
+            overloaded = is_overload(e)
+            raise
+        finally:
+            self.release(time.perf_counter() - started, overloaded or call.status in retry_statuses)
+
+    def log_stats(self):
+        log.info(f"Concurrency {self.name} : limit {self.limit:.1f} of {self.maximum}, {self.decreases} backoffs, smoothed latency {(self.latency or 0.0) * 1000:.1f} ms")
+
+
+# Shared by every Planon call, REST SDK, REST session and SOAP
+planon_limiter = AdaptiveLimiter('planon')
@@ -1,15 +1,29 @@
 import logging
+import math
+
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 
 import utils.logger
 
+from metrics import metrics
+
 import requests
 
+from transport import get_session
+
 # *****************************************************************************
 #
 # *****************************************************************************
 
 log = logging.getLogger(__name__)
 
+# Shared keep-alive session sized for concurrent page fetches
+max_page_workers = 8
+
+session = get_session('dartmouth', pool_size=max_page_workers)
+
 #
 # *************************************************************************************************
 # *
@@ -24,7 +38,7 @@ def login_jwt(login_url, api_key, scopes=None):
         url = login_url
 
     # print("url = "+url)
-    response = requests.post(url,headers=headers)
+    response = session.post(url,headers=headers)
     response.raise_for_status()
     response_json = response.json()
     jwt = response_json["jwt"]
@@ -42,11 +56,33 @@ def login_jwt(login_url, api_key, scopes=None):
 # *
 # *************************************************************************************************
 #
+def get_resource_change_messages(jwt, resource_change_url, queue_name, max_messages=100):
+
+  # Assumed: GET on the queue url returns a JSON list of at most pagesize pending messages
+  headers={'Authorization': 'Bearer '+jwt,'Content-Type':'application/json'}
+  params = {'queue_name': queue_name, 'pagesize': str(max_messages)}
+  with metrics.time('dartmouth_change_messages'):
+      response = session.get(resource_change_url, headers=headers, params=params)
+      response.raise_for_status()
+  return response.json()
+
+
+def get_resource_document(jwt, resource_url, resource_id):
+
+  # One document by id, None when it no longer exists
+  headers={'Authorization': 'Bearer '+jwt,'Content-Type':'application/json'}
+  response = session.get(resource_url + '/' + str(resource_id), headers=headers)
+  if response.status_code == 404:
+      return None
+  response.raise_for_status()
+  return response.json()
+
+
 def delete_resource_change_message(jwt, resource_change_url, queue_name, message_id):
 
   headers={'Authorization': 'Bearer '+jwt,'Content-Type':'application/json'}
   url = resource_change_url + '/' + message_id
-  response = requests.delete(url, headers=headers)
+  response = session.delete(url, headers=headers)
   response.raise_for_status()
   return True
 
@@ -56,7 +92,10 @@ def delete_resource_change_message(jwt, resource_change_url, queue_name, message
 # *
 # *************************************************************************************************
 #
-def get_resource_by_query(resource_url, jwt, query_dict={}):
+def get_resource_by_query(resource_url, jwt, query_dict={}, workers=1):
+
+    if workers > 1:
+        return list(iter_resource_by_query(resource_url, jwt, query_dict, workers=workers))
 
     headers = {'Authorization': 'Bearer '+jwt,
                'Content-Type': 'application/json'}
@@ -84,8 +123,9 @@ def get_resource_by_query(resource_url, jwt, query_dict={}):
 
         log.info(f'calling get with url={resource_url}')
 
-        response = requests.get(resource_url, headers=headers, params=params)
-        response.raise_for_status()
+        with metrics.time('dartmouth_page'):
+            response = session.get(resource_url, headers=headers, params=params)
+            response.raise_for_status()
 
         if page_number == 1:
             continuation_key = response.headers.get("x-request-id")
@@ -108,6 +148,80 @@ def get_resource_by_query(resource_url, jwt, query_dict={}):
     return resource_documents
 
 
+#
+# *************************************************************************************************
+# * Page 1 returns x-total-count and the continuation key, so the remaining pages are known up
+# * front (counted in the page size the server actually served) and are fetched concurrently.
+# * Documents are yielded as each page arrives, page order is not preserved.
+# *************************************************************************************************
+#
+def get_resource_page(resource_url, headers, params):
+
+    log.info(f'getting page {params["page"]} of results from url={resource_url}')
+
+    with metrics.time('dartmouth_page'):
+        response = session.get(resource_url, headers=headers, params=params)
+        response.raise_for_status()
+    return response
+
+
+def iter_resource_by_query(resource_url, jwt, query_dict=None, workers=max_page_workers, page_size=1000):
+
+    headers = {'Authorization': 'Bearer '+jwt,
+               'Content-Type': 'application/json'}
+
+    params = dict(query_dict or {})
+    params['pagesize'] = str(page_size)
+    params['page'] = '1'
+
+    response = get_resource_page(resource_url, headers, params)
+
+    continuation_key = response.headers.get("x-request-id")
+    total_count = int(response.headers.get("x-total-count"))
+    log.info(f'retrieving x-total-count documents of {str(total_count)}')
+
+    first_page = response.json()
+    retrieved = 0
+    for document in first_page:
+        retrieved += 1
+        yield document
+
+    # The server may cap the page size, so pages are counted in what page 1 actually returned,
+    # and fetching goes on past that count until the total is reached or a page comes back empty
+    served_size = len(first_page) or page_size
+    next_page = 2
+    exhausted = not first_page
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while retrieved < total_count and not exhausted:
+            page_count = math.ceil((total_count - retrieved) / served_size)
+            pages = iter(range(next_page, next_page + page_count))
+            next_page += page_count
+
+            in_flight = set()
+            while True:
+                for page_number in pages:
+                    page_params = {'continuation_key': continuation_key, 'pagesize': str(page_size), 'page': str(page_number)}
+                    in_flight.add(executor.submit(get_resource_page, resource_url, headers, page_params))
+                    if len(in_flight) >= workers * 2:
+                        break
+
+                if not in_flight:
+                    break
+
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    documents = future.result().json()
+                    if not documents:
+                        exhausted = True
+                    for document in documents:
+                        retrieved += 1
+                        yield document
+
+    if retrieved != total_count:
+        raise Exception(f"Number of resource documents retrieved {str(retrieved)} do not match total number in payload header {str(total_count)}")
+
+
 #
 # *************************************************************************************************
 # *
@@ -120,7 +234,7 @@ def get_person(jwt, people_url, netid):
     url = people_url + "/" + netid
 
     try:
-        response = requests.get(url, headers=headers)
+        response = session.get(url, headers=headers)
         response.raise_for_status()
     except requests.exceptions.HTTPError as err:
         if response.status_code == 404:
@@ -0,0 +1,496 @@
+import argparse
+import logging
+import os
+import random
+import re
+import sys
+import time
+
+from contextlib import contextmanager
+from operator import itemgetter
+from types import SimpleNamespace
+from typing import Callable
+from typing import List
+
+import planon
+import yaml
+
+import utils.logger
+
+import staging
+from asset_resolver import AssetResolver
+from asset_resolver import chunked
+from asset_resolver import field_value
+from asset_resolver import unpack_error
+from changeset import ChangesetWriter
+from changeset import apply_changeset
+from changeset import planon_snapshot
+from concurrency import planon_limiter
+from failures import FailureQueue
+from failures import read_failures
+from failures import recover_queue
+from failures import retain_failures
+from fingerprints import FingerprintStore
+from fingerprints import fingerprint
+from fingerprints import merge_fingerprints
+from importer import ImportStats
+from importer import RateLimiter
+from importer import read_rows
+from importer import run_concurrently
+from journal import Journal
+from location_index import LocationIndex
+from metrics import metrics
+from sharding import merge_results
+from sharding import parse_shard
+from sharding import run_shards
+from sharding import shard_path
+from sharding import shard_rows
+from sharding import write_result
+from transport import get_session
+from transport import log_connection_stats
+
+
+log = logging.getLogger(__name__)
+
+# Processing / updated lines, sampled and rate limited by LOG_ROW_SAMPLE / LOG_ROW_MAX_PER_SECOND
+row_log = utils.logger.get_row_logger(__name__)
+
+# ============================================================
+# MAPPING
+# A YAML mapping (see mappings/) names the barcode, location and
+# match columns and the Planon fields to write. It is compiled once
+# into itemgetters and %-style log formats so the per-row path does
+# no dict building or eager string formatting.
+# ============================================================
+
+def tuple_getter(columns: List[str]) -> Callable:
+    # itemgetter that always returns a tuple, whatever the column count
+    if not columns:
+        return lambda row: ()
+    if len(columns) == 1:
+        getter = itemgetter(columns[0])
+        return lambda row: (getter(row),)
+    return itemgetter(*columns)
+
+
+def compile_message(template: str) -> tuple:
+    # "Updated {CODE}" -> ("Updated %s", getter) for lazy log formatting
+    columns = re.findall(r'\{(\w+)\}', template)
+    return re.sub(r'\{\w+\}', '%s', template.replace('%', '%%')), tuple_getter(columns)
+
+
+class Mapping:
+
+    def __init__(self, path: str):
+        with open(path) as file:
+            config = yaml.safe_load(file)
+
+        self.name = config['name']
+        self.input = config['input']
+        self.barcode_column = config['barcode']
+        self.match = dict(config['match'])
+        self.key_field = next(iter(self.match))
+        self.fields = tuple(config['fields'])
+        self.columns = tuple(config['fields'].values())
+
+        self.journal_path = config.get('journal', f"cache/{self.name}.journal")
+        self.fingerprints_path = config.get('fingerprints', f"cache/{self.name}_fingerprints.json")
+        self.changeset_path = config.get('changeset', f"output/{self.name}.changeset.jsonl")
+        self.failures_path = config.get('failures', f"output/{self.name}.failures.jsonl")
+        self.results_path = config.get('results', f"output/{self.name}.result.json")
+
+        property_column = config['location']['property']
+        space_column = config['location'].get('space')
+
+        # Compiled per-row accessors
+        self.barcode = itemgetter(self.barcode_column)
+        self.property_code = itemgetter(property_column)
+        # Rows are sharded by property so each shard's location lookups stay local
+        self.shard_key = self.property_code
+        self.location = tuple_getter([property_column, space_column]) if space_column else (lambda row: (row[property_column], ''))
+        self.values = tuple_getter(list(self.columns))
+        self.match_values = tuple_getter(list(self.match.values()))
+        self.other_match_values = tuple_getter([column for field, column in self.match.items() if field != self.key_field])
+
+        messages = config.get('messages', {})
+        self.processing = compile_message(messages.get('processing', f"Processing asset {{{self.barcode_column}}}"))
+        self.updated = compile_message(messages.get('updated', f"Updated {{{self.barcode_column}}}"))
+
+    def journal_key(self, row: dict) -> str:
+        return '|'.join(self.match_values(row))
+
+    def fingerprint(self, row: dict) -> str:
+        return fingerprint(*self.other_match_values(row), *self.values(row))
+
+    def changes(self, me_asset, row: dict) -> dict:
+        return {
+            field: value
+            for field, value in zip(self.fields, self.values(row))
+            if field_value(getattr(me_asset, field)) != value
+        }
+
+    def assign(self, me_asset, changes: dict):
+        # Only the fields that differ are set, unchanged ones stay clean on the SDK object
+        for field, value in changes.items():
+            setattr(me_asset, field, value)
+
+
+# ============================================================
+# IMPORTER
+# ============================================================
+
+class Importer:
+
+    def __init__(self, mapping: Mapping, args):
+        self.mapping = mapping
+        self.args = args
+
+        # Planon API configuration
+        planon.PlanonResource.set_site(site=os.environ['PLANON_API_URL'])
+        planon.PlanonResource.set_header(jwt=os.environ['PLANON_API_KEY'])
+
+        log.debug("Setting up REST API session")
+        self.session = get_session('planon', params={"accesskey": os.environ.get("PLANON_API_KEY")})
+
+        self.rate_limiter = RateLimiter(args.max_rps)
+
+        # Properties are loaded with the first chunk, spaces are prefetched per chunk as the CSV streams in
+        self.location_index = LocationIndex(rate_limiter=self.rate_limiter)
+
+        # --workers is the ceiling, the limiter starts low and finds how many Planon calls to keep in flight
+        planon_limiter.configure(initial=min(args.workers, 4), maximum=args.workers)
+        self.asset_resolver = AssetResolver(match=mapping.match, chunk_size=args.chunk_size, key_field=mapping.key_field, rate_limiter=self.rate_limiter)
+
+        self.fingerprint_store = FingerprintStore(args.fingerprints, args.fingerprint_updates)
+
+        # Only direct runs are journaled, plan and apply are re-runnable as a whole
+        self.journal = Journal(args.journal, row_key=mapping.journal_key, resume=args.resume) if args.mode == 'run' else None
+
+        # Failed rows of a run go to a classified retry queue, replay rewrites it as it goes
+        if args.mode == 'run' and args.resume:
+            # Rows the resumed run processes again drop their old entries, they are written again if they still fail
+            retain_failures(args.failures, self.journal.committed_filter())
+        self.failures = FailureQueue(args.failures, append=args.resume) if args.mode == 'run' else None
+        self.stats = ImportStats(journal=self.journal, failures=self.failures)
+        self.failed = self.stats.failed
+
+    def validate_chunk(self, chunk: list) -> list:
+        mapping = self.mapping
+
+        # Spaces for properties first seen in this chunk are loaded in one call
+        try:
+            self.location_index.prefetch(mapping.property_code(row) for row in chunk if mapping.barcode(row))
+        except Exception as e:
+            # Properties that did not load are loaded again by each row's lookup below, which fails only that row
+            log.warning(f"Location prefetch failed, falling back to per-row lookups: {repr(e)}")
+
+        pending = []
+        for row in chunk:
+            row_log.info(mapping.processing[0], *mapping.processing[1](row))
+            try:
+                barcode = int(mapping.barcode(row)) if mapping.barcode(row) else None #Primary key
+                row_log.info("Found asset %s", mapping.barcode(row))
+
+                if barcode:
+                    self.location_index.get(*mapping.location(row))
+                    pending.append(row)
+                else:
+                    log.error('No barcode provided')
+                    self.stats.no_barcode(row)
+                    row_log.info("No barcode")
+            except Exception as e:
+                self.stats.fail(row, e)
+                log.info("%r", e)
+
+        return pending
+
+    def process_chunk(self, chunk: list):
+        mapping = self.mapping
+
+        pending = []
+        for row in self.validate_chunk(chunk):
+            if self.args.incremental and self.fingerprint_store.unchanged(mapping.barcode(row), mapping.fingerprint(row)):
+                row_log.info("Skipped unchanged asset %s", mapping.barcode(row))
+                self.stats.skipped(row)
+            else:
+                pending.append(row)
+
+        # READ FILTER, one find per chunk on the match fields
+        try:
+            resolved = list(self.asset_resolver.resolve(pending))
+        except Exception as e:
+            for row in pending:
+                self.stats.fail(row, e)
+            log.info("%r", e)
+            return
+
+        for row, me_asset, error in resolved:
+            try:
+                if error:
+                    raise error
+
+                changes = mapping.changes(me_asset, row)
+                if not changes:
+                    row_log.info("Skipped save for %s, Planon values already match", mapping.barcode(row))
+                    self.fingerprint_store.record(mapping.barcode(row), mapping.fingerprint(row))
+                    self.stats.skipped(row)
+                    continue
+
+                # UPDATE ASSETS
+                mapping.assign(me_asset, changes)
+                self.rate_limiter.acquire()
+                with planon_limiter.slot(), metrics.time('usrmeasset_save', 'planon UsrMEAsset.save'):
+                    me_asset.save()
+
+                row_log.info(mapping.updated[0], *mapping.updated[1](row))
+                self.fingerprint_store.record(mapping.barcode(row), mapping.fingerprint(row))
+                self.stats.succeeded(row)
+            except Exception as e:
+                self.stats.fail(row, e)
+                log.info("%r", e)
+
+    def run(self):
+        rows = read_rows(self.args.input)
+        if self.args.shard:
+            rows = shard_rows(rows, self.mapping.shard_key, self.args.shard)
+
+        try:
+            rows = self.journal.pending(rows)
+            run_concurrently(chunked(rows, self.args.chunk_size), self.process_chunk, workers=self.args.workers)
+        finally:
+            self.journal.close()
+            self.failures.close()
+        self.fingerprint_store.save()
+
+        stats = self.stats
+        log.info(f"Total number of assets_updated :  {stats.success_count}")
+        log.info(f"Total number of assets failed t0 update :  {stats.fail_count}")
+        log.info(f"Total number ofwith no barcode :  {stats.nobarcode_count}")
+        log.info(f"Total number of assets skipped as unchanged :  {stats.skipped_count}")
+        log.info(f"Asset lookups : {self.asset_resolver.api_calls} UsrMEAsset find calls")
+
+        write_result(self.args.results, {
+            'succeeded': stats.success_count,
+            'failed': stats.fail_count,
+            'no_barcode': stats.nobarcode_count,
+            'skipped': stats.skipped_count,
+            'asset_lookups': self.asset_resolver.api_calls,
+        })
+
+    def replay(self):
+        # Reprocesses only the rows of the replayed classes, the other failures are carried over untouched
+        classes = set(self.args.replay_classes.split(','))
+        replaying = f"{self.args.failures}.replaying"
+        remaining = 0
+
+        # A round that crashed left its input behind, replacing it would lose the rows it never reprocessed
+        recover_queue(self.args.failures, replaying)
+
+        for attempt in range(self.args.replay_attempts):
+            if not os.path.exists(self.args.failures):
+                log.info(f"No failure queue at {self.args.failures}, nothing to replay")
+                break
+
+            os.replace(self.args.failures, replaying)
+            retry = []
+            kept = []
+            for failure in read_failures(replaying):
+                (retry if failure['class'] in classes else kept).append(failure)
+
+            if not retry:
+                os.replace(replaying, self.args.failures)
+                break
+
+            if attempt:
+                delay = random.uniform(0.5, 1.0) * self.args.replay_backoff * 2 ** (attempt - 1)
+                log.info(f"Waiting {delay:.1f}s before replay round {attempt + 1}")
+                time.sleep(delay)
+
+            self.failures = self.stats.failures = FailureQueue(self.args.failures)
+            self.failures.extend(kept)
+            failed_before = self.stats.fail_count
+            try:
+                run_concurrently(chunked((failure['row'] for failure in retry), self.args.chunk_size), self.process_chunk, workers=self.args.workers)
+            finally:
+                self.failures.close()
+            os.remove(replaying)
+
+            remaining = self.stats.fail_count - failed_before
+            log.info(f"Replay round {attempt + 1} : {len(retry)} rows replayed, {remaining} failed again")
+            if not remaining:
+                break
+
+        self.fingerprint_store.save()
+
+        log.info(f"Total number of assets_updated :  {self.stats.success_count}")
+        log.info(f"Total number of assets skipped as unchanged :  {self.stats.skipped_count}")
+        log.info(f"Total number of assets still failing :  {remaining}")
+        log.info(f"Asset lookups : {self.asset_resolver.api_calls} UsrMEAsset find calls")
+
+    @contextmanager
+    def asset_matcher(self):
+        # Yields rows -> [matching assets per row], from the SQL staging tables when --staging is set, local snapshots otherwise
+        mapping = self.mapping
+
+        if self.args.staging:
+            staging_engine = staging.get_engine(self.args.staging)
+            self.location_index.load_snapshot(*staging.location_records(staging_engine))
+            with staging.StagedAssetResolver(staging_engine, mapping.match) as resolver:
+                yield resolver.resolve
+            return
+
+        ttl = self.args.snapshot_ttl
+        asset_fields = list(dict.fromkeys(['Syscode', *mapping.match, *mapping.fields]))
+        me_assets = planon_snapshot('UsrMEAsset', asset_fields, ttl).load()
+        self.location_index.load_snapshot(
+            planon_snapshot('Property', ['Code', 'Syscode'], ttl).load(),
+            planon_snapshot('Space', ['Code', 'PropertyRef', 'Syscode'], ttl).load(),
+        )
+
+        matches = {}
+        for me_asset in me_assets.dicts():
+            me_asset = SimpleNamespace(**me_asset)
+            matches.setdefault(self.asset_resolver.asset_key(me_asset), []).append(me_asset)
+
+        yield lambda rows: [matches.get(self.asset_resolver.row_key(row), []) for row in rows]
+
+    def plan(self):
+        # Resolves every row locally, no Planon calls once the snapshots are fresh or the staging tables are synced
+        mapping = self.mapping
+
+        with self.asset_matcher() as find_matches, ChangesetWriter(self.args.changeset) as writer:
+            for chunk in chunked(read_rows(self.args.input), self.args.chunk_size):
+                rows = self.validate_chunk(chunk)
+                for row, row_matches in zip(rows, find_matches(rows)):
+                    if len(row_matches) != 1:
+                        self.stats.fail(row, unpack_error(len(row_matches)))
+                        continue
+
+                    changes = mapping.changes(row_matches[0], row)
+                    if changes:
+                        writer.write(row_matches[0].Syscode, mapping.barcode(row), changes)
+                        self.stats.succeeded(row)
+                    else:
+                        self.stats.skipped(row)
+
+        stats = self.stats
+        log.info(f"Total number of assets with planned changes :  {stats.success_count}")
+        log.info(f"Total number of assets already up to date :  {stats.skipped_count}")
+        log.info(f"Total number of assets that could not be planned :  {stats.fail_count}")
+        log.info(f"Total number ofwith no barcode :  {stats.nobarcode_count}")
+
+    def sync(self):
+        counts = staging.sync(staging.get_engine(self.args.staging))
+        for resource_name, count in counts.items():
+            log.info(f"Total number of staged {resource_name} records :  {count}")
+
+    def apply(self):
+        apply_changeset(self.args.changeset, self.stats, chunk_size=self.args.chunk_size, workers=self.args.workers, rate_limiter=self.rate_limiter)
+
+        log.info(f"Total number of assets_updated :  {self.stats.success_count}")
+        log.info(f"Total number of assets failed t0 update :  {self.stats.fail_count}")
+
+    def execute(self):
+        if self.args.mode == 'plan':
+            self.plan()
+        elif self.args.mode == 'apply':
+            self.apply()
+        elif self.args.mode == 'sync':
+            self.sync()
+        elif self.args.mode == 'replay':
+            self.replay()
+        else:
+            self.run()
+
+        self.location_index.log_stats()
+        planon_limiter.log_stats()
+        log_connection_stats()
+        utils.logger.log_row_stats()
+
+
+# ============================================================
+# COMMAND LINE
+# ============================================================
+
+def build_parser(mapping: Mapping) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=f"Planon asset import driven by the {mapping.name} mapping")
+    parser.add_argument('mode', nargs='?', choices=['run', 'plan', 'apply', 'sync', 'replay', 'merge'], default='run', help="run updates directly, plan writes a changeset from local snapshots, apply executes it, sync refreshes the SQL staging tables, replay retries queued failures, merge sums the results of a sharded run")
+    parser.add_argument('--changeset', default=mapping.changeset_path, help="Changeset written by plan and read by apply")
+    parser.add_argument('--snapshot-ttl', type=int, default=3600, help="Seconds the local Planon snapshots used by plan stay valid")
+    parser.add_argument('--staging', default=os.environ.get('STAGING_DATABASE_URL'), help="SQLAlchemy URL of the staging tables, plan joins against them instead of the snapshots")
+    parser.add_argument('--input', default=mapping.input, help="CSV to load, may be gzip compressed")
+    parser.add_argument('--chunk-size', type=int, default=100, help="Rows resolved per UsrMEAsset find")
+    parser.add_argument('--workers', type=int, default=1, help="Chunks processed concurrently, the most Planon calls the adaptive limiter will keep in flight")
+    parser.add_argument('--incremental', action='store_true', help="Skip rows whose mapped fields are unchanged since the last run")
+    parser.add_argument('--fingerprints', default=mapping.fingerprints_path, help="Fingerprint store used by --incremental")
+    parser.add_argument('--journal', default=mapping.journal_path, help="Journal of processed rows used by --resume")
+    parser.add_argument('--resume', action='store_true', help="Continue an interrupted run, skipping rows the journal records as updated, unchanged or without barcode, failed rows are retried")
+    parser.add_argument('--failures', default=mapping.failures_path, help="Classified failure queue written by run and consumed by replay")
+    parser.add_argument('--replay-classes', default='transient', help="Comma separated failure classes replay retries: transient, auth, not_found, ambiguous, no_barcode, other")
+    parser.add_argument('--replay-attempts', type=int, default=3, help="Replay rounds while rows keep failing")
+    parser.add_argument('--replay-backoff', type=float, default=5.0, help="Seconds before the second replay round, doubled each round")
+    parser.add_argument('--shard', type=parse_shard, default=None, help="i/K, process only the rows whose BUILDING_ID hashes to shard i of K")
+    parser.add_argument('--shards', type=int, default=1, help="Run K shard processes of this import and merge their results")
+    parser.add_argument('--results', default=mapping.results_path, help="Counts of the run, one file per shard when sharded")
+    parser.add_argument('--max-rps', type=float, default=None, help="Maximum Planon requests per second across all workers")
+    parser.add_argument('--metrics-json', default=None, help="Write stage timings and API call counts as JSON")
+    parser.add_argument('--metrics-prom', default=None, help="Write the same metrics as a Prometheus textfile")
+    parser.add_argument('--metrics-interval', type=float, default=60, help="Seconds between metric writes during the run")
+
+    # Set for --shard, where the fingerprints recorded by the shard go until merge folds them into --fingerprints
+    parser.set_defaults(fingerprint_updates=None)
+    return parser
+
+
+def log_merged(args):
+    totals = merge_results(args.results, args.failures, args.shards)
+    merge_fingerprints(args.fingerprints, [shard_path(args.fingerprints, (index, args.shards)) for index in range(args.shards)])
+
+    log.info(f"Total number of assets_updated :  {totals['succeeded']}")
+    log.info(f"Total number of assets failed t0 update :  {totals['failed']}")
+    log.info(f"Total number ofwith no barcode :  {totals['no_barcode']}")
+    log.info(f"Total number of assets skipped as unchanged :  {totals['skipped']}")
+    log.info(f"Asset lookups : {totals['asset_lookups']} UsrMEAsset find calls")
+    if totals['missing_shards']:
+        log.error(f"{totals['missing_shards']} of {args.shards} shards left no result, the totals above are incomplete")
+
+    return totals
+
+
+def main(mapping_path: str, argv: List[str] = None) -> Importer:
+    mapping = Mapping(mapping_path)
+    parser = build_parser(mapping)
+    args = parser.parse_args(argv)
+
+    if args.mode == 'merge' or (args.shards > 1 and not args.shard):
+        if args.shards < 2:
+            parser.error("merge needs --shards K")
+        if args.mode != 'merge':
+            if args.mode != 'run':
+                parser.error("--shards only runs the run mode, use --shard i/K for the others")
+            exit_codes = run_shards(sys.argv[0], sys.argv[1:] if argv is None else argv, args.shards, outputs=[args.results, args.failures])
+
+        log_merged(args)
+        if args.mode != 'merge' and any(exit_codes):
+            sys.exit(1)
+        return None
+
+    if args.shard:
+        # Every per-run file gets its own copy per shard. The fingerprint store is shared, keyed by Code and
+        # independent of K, each shard reads it and writes its own updates for merge to fold back in
+        for name in ('journal', 'failures', 'results', 'metrics_json', 'metrics_prom'):
+            setattr(args, name, shard_path(getattr(args, name), args.shard))
+        args.fingerprint_updates = shard_path(args.fingerprints, args.shard)
+
+        # A shard that does not finish leaves no result, rather than the one of an earlier run
+        if os.path.exists(args.results):
+            os.remove(args.results)
+
+    metrics.start_writer(args.metrics_json, args.metrics_prom, args.metrics_interval)
+    try:
+        importer = Importer(mapping, args)
+        importer.execute()
+    finally:
+        metrics.stop_writer(args.metrics_json, args.metrics_prom)
+
+    return importer
@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import threading
+
+from collections import Counter
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+
+import utils.logger
+
+from concurrency import error_status
+from concurrency import is_overload
+
+
+log = logging.getLogger(__name__)
+
+# Failure classes, only transient failures are replayed by default
+NOT_FOUND = 'not_found'
+AMBIGUOUS = 'ambiguous'
+NO_BARCODE = 'no_barcode'
+TRANSIENT = 'transient'
+AUTH = 'auth'
+OTHER = 'other'
+
+retryable_classes = frozenset([TRANSIENT])
+
+# ============================================================
+# FUNCTIONS
+# ============================================================
+
+def classify(error: Exception) -> str:
+    message = str(error)
+
+    if error_status(error) in (401, 403):
+        return AUTH
+    if is_overload(error):
+        return TRANSIENT
+    if message.startswith('not enough values to unpack') or message.startswith('No Planon property found') or isinstance(error, LookupError):
+        return NOT_FOUND
+    if message.startswith('too many values to unpack'):
+        return AMBIGUOUS
+    return OTHER
+
+
+# ============================================================
+# FAILURE QUEUE
+# One JSON line per failed row, {"class", "error", "row"}, written
+# as failures happen so a crashed run still leaves its queue behind
+# ============================================================
+
+class FailureQueue:
+
+    def __init__(self, path: str, append: bool = False):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.file = open(path, 'a' if append else 'w', buffering=1)
+        self.counts = Counter()
+
+    def write(self, failure_class: str, error: str, row: dict):
+        line = json.dumps({'class': failure_class, 'error': error, 'row': row}, separators=(',', ':'), default=str) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.counts[failure_class] += 1
+
+    def fail(self, row: dict, error: Exception):
+        self.write(classify(error), repr(error), row)
+
+    def no_barcode(self, row: dict):
+        self.write(NO_BARCODE, 'No barcode', row)
+
+    def extend(self, failures: Iterable[dict]):
+        for failure in failures:
+            self.write(failure['class'], failure['error'], failure['row'])
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+        if self.counts:
+            log.info(f"Failures by class : {', '.join(f'{name} {count}' for name, count in self.counts.most_common())} in {self.path}")
+
+
+def read_failures(path: str) -> Iterator[dict]:
+    if not os.path.exists(path):
+        return
+
+    with open(path) as file:
+        for line in file:
+            # A torn last line from a crash is skipped
+            try:
+                yield json.loads(line)
+            except ValueError:
+                log.warning(f"Skipping unreadable line in {path}")
+
+
+def retain_failures(path: str, keep: Callable):
+    # Rewrites the queue with only the failures keep(failure) accepts
+    if not os.path.exists(path):
+        return
+
+    kept = [failure for failure in read_failures(path) if keep(failure)]
+    queue = FailureQueue(path)
+    queue.extend(kept)
+    queue.close()
+
+
+def recover_queue(path: str, leftover: str):
+    # Merges a queue left behind by a crashed replay round back into path. The leftover holds the
+    # round's whole input, rows it never got to exist only there; a row in both is kept once
+    if not os.path.exists(leftover):
+        return
+
+    merged = {}
+    for source in (leftover, path):
+        for failure in read_failures(source):
+            merged.setdefault(json.dumps(failure['row'], sort_keys=True, default=str), failure)
+
+    queue = FailureQueue(path)
+    queue.extend(merged.values())
+    queue.close()
+    os.remove(leftover)
+
+    log.warning(f"Recovered {len(merged)} failures from interrupted replay {leftover} into {path}")
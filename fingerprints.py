@@ -0,0 +1,86 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from typing import List
+
+import utils.logger
+
+from storage import write_atomic
+
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# FUNCTIONS
+# ============================================================
+
+def fingerprint(*values) -> str:
+    text = '\x1f'.join('' if value is None else str(value) for value in values)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+# ============================================================
+# FINGERPRINT STORE
+# Asset Code -> fingerprint of the values last written to Planon.
+# A shard reads the shared store and saves only the fingerprints it
+# recorded to updates_path, merge_fingerprints folds them back in.
+# ============================================================
+
+class FingerprintStore:
+
+    def __init__(self, path: str, updates_path: str = None):
+        self.path = path
+        self.updates_path = updates_path
+        self.lock = threading.Lock()
+        self.updated = {}
+
+        if os.path.exists(path):
+            with open(path) as file:
+                self.previous = json.load(file)
+        else:
+            self.previous = {}
+
+        self.current = dict(self.previous)
+        log.info(f"Loaded {len(self.previous)} asset fingerprints from {path}")
+
+    def unchanged(self, code: str, value: str) -> bool:
+        return self.previous.get(code) == value
+
+    def record(self, code: str, value: str):
+        with self.lock:
+            self.current[code] = value
+            self.updated[code] = value
+
+    def save(self):
+        if self.updates_path:
+            with self.lock:
+                data = json.dumps(self.updated, separators=(',', ':'))
+
+            write_atomic(self.updates_path, data)
+            log.info(f"Saved {len(self.updated)} updated asset fingerprints to {self.updates_path}")
+            return
+
+        with self.lock:
+            data = json.dumps(self.current, separators=(',', ':'))
+
+        write_atomic(self.path, data)
+        log.info(f"Saved {len(self.current)} asset fingerprints to {self.path}")
+
+
+def merge_fingerprints(path: str, updates_paths: List[str]):
+    # Folds the updates files written by shards into the shared store and removes them
+    updates_paths = [updates_path for updates_path in updates_paths if os.path.exists(updates_path)]
+    if not updates_paths:
+        return
+
+    store = FingerprintStore(path)
+    for updates_path in updates_paths:
+        with open(updates_path) as file:
+            store.current.update(json.load(file))
+
+    store.save()
+    for updates_path in updates_paths:
+        os.remove(updates_path)
@@ -3,14 +3,30 @@ import json
 import os
 import logging
 import typing
-import pickle
+import functools
+import random
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from collections import namedtuple
+from itertools import islice
 
 import zeep
 import requests
 
 import utils.logger
 import libplanon
+import planon
 from utils.dart_api import get_resource_by_query, login_jwt
+from concurrency import error_status
+from concurrency import planon_limiter
+from lazy import lazy
+from metrics import metrics
+from snapshot_cache import SnapshotCache
+from transport import get_session
+from transport import retry_statuses
+from transport import use_for_soap
 
 # ============================================================
 # LOGGING
@@ -22,21 +38,13 @@ log = logging.getLogger(__name__)
 # SETUP
 # ============================================================
 
-log.debug("Setting up REST API session")
-session = requests.Session()
-session.params = {
-    "accesskey": os.environ.get("PLN_REST_KEY")
-}
-
-try:
-    response = session.get(url=os.environ.get("PLN_REST_URL"))
-    response.raise_for_status()
-except Exception as e:
-    log.error(repr(e))
+# Nothing in this section touches the network, clients, tokens and
+# reference data are set up by the accessors below on first use
 
-asset_group_cache_path = "cache/asset_groups.pickle"
-properties_cache_path = "cache/properties.pickle"
-spaces_cache_path = "cache/spaces.pickle"
+# Cache lifetimes in seconds, a stale cache is refreshed on load
+asset_groups_cache_ttl = int(os.environ.get("ASSET_GROUPS_CACHE_TTL", 7 * 24 * 3600))
+properties_cache_ttl = int(os.environ.get("PROPERTIES_CACHE_TTL", 7 * 24 * 3600))
+spaces_cache_ttl = int(os.environ.get("SPACES_CACHE_TTL", 24 * 3600))
 
 ethernet_categories = set([
     "AnalogPhone",
@@ -75,60 +83,149 @@ ethernet_categories = set([
     "Other",
 ])
 
-get_token = libplanon.TokenManager(url=os.environ.get('PLN_URL'), username=os.environ.get('PLN_USR'), password=os.environ.get('PLN_PWD')).get_token
+pln_services = ['ItemGroup','UsrAsset', 'UsrMEAsset', 'StandardAsset','BuildingElement','Property','Space']
+
+# Concurrent SOAP reads
+soap_workers = 8
+
+# Concurrent asset creates / updates
+upsert_workers = 8
+
+# Method for sending only the changed fields of an asset (upsert_assets(partial=True), opt-in until
+# the Planon REST service is confirmed to accept it)
+partial_update_method = os.environ.get("PLN_REST_PARTIAL_METHOD", "PATCH")
+
+# REST asset body field -> UsrAsset field, to compare a body with the record from the bulk find
+asset_state_fields = {
+    "code": "Code",
+    "name": "Name",
+    "propertyRef": "PropertyRef",
+    "spaceRef": "SpaceRef",
+    "isSimple": "IsSimple",
+    "departmentRef": "DepartmentRef",
+    "constructionDate": "ConstructionDate",
+    "itemGroupRef": "ItemGroupRef",
+    "isArchived": "IsArchived",
+    "dossier": "Dossier",
+    "parentRef": "ParentRef",
+}
+asset_attribute_fields = ["NSJACKID", "NSCABLETYPE", "NSLEGACYPATCH"]
+
+# ============================================================
+# LAZY SETUP
+# ============================================================
+
+@lazy
+def get_rest_session():
+    log.debug("Setting up REST API session")
+    session = get_session('planon-rest', params={
+        "accesskey": os.environ.get("PLN_REST_KEY")
+    })
+
+    try:
+        response = session.get(url=os.environ.get("PLN_REST_URL"))
+        response.raise_for_status()
+    except Exception as e:
+        log.error(repr(e))
+
+    return session
+
+
+@lazy
+def get_token_manager():
+    return libplanon.TokenManager(url=os.environ.get('PLN_URL'), username=os.environ.get('PLN_USR'), password=os.environ.get('PLN_PWD'))
+
 
-pln_client = libplanon.APIManager(url=os.environ.get('PLN_URL'), services=['ItemGroup','UsrAsset', 'UsrMEAsset', 'StandardAsset','BuildingElement','Property','Space'])
+def get_token():
+    return get_token_manager().get_token()
+
+
+@lazy
+def get_pln_client():
+    log.debug("Setting up Planon SOAP clients")
+    return libplanon.APIManager(url=os.environ.get('PLN_URL'), services=pln_services)
+
+
+@functools.lru_cache(maxsize=None)
+def get_pln_service(name: str):
+    # Route every SOAP client through one pooled session with timeouts and retries
+    pln_service = get_pln_client()[name]
+    use_for_soap(pln_service)
+    return pln_service
+
+
+@lazy
+def get_planon_sdk():
+    # The REST SDK, used for the multi-value finds the SOAP services do not offer
+    planon.PlanonResource.set_site(site=os.environ['PLANON_API_URL'])
+    planon.PlanonResource.set_header(jwt=os.environ['PLANON_API_KEY'])
+    return planon
+
+
+@lazy
+def get_jwt():
+    return login_jwt(f"{os.environ.get('API_BASE_URL')}/jwt", os.environ.get("API_KEY"), "api:facilities:properties:read")
 
-pln_asset_client = pln_client['UsrAsset']
-pln_property_client = pln_client['Property']
-pln_space_client = pln_client['Space']
-pln_item_group_client = pln_client['ItemGroup']
 
 # ============================================================
 # FUNCTIONS
 # ============================================================
 
-def get_pln_asset_groups():
+def read_pln_asset_group(token, planon_asset_group_id) -> dict:
+    # Serialized in the worker as soon as the read returns
+    with planon_limiter.slot(), metrics.time('soap_read', 'planon-soap ItemGroup.read'):
+        pln_item_group = get_pln_service('ItemGroup').read(token, planon_asset_group_id)
+    return zeep.helpers.serialize_object(pln_item_group, dict)
+
+
+def get_pln_asset_groups(workers: int = soap_workers, chunk_size: int = 100):
     # Cache asset group
     log.info("Caching planon asset groups")
-    planon_asset_group_ids = pln_item_group_client.find(get_token(),{})
+    with planon_limiter.slot():
+        planon_asset_group_ids = get_pln_service('ItemGroup').find(get_token(),{})
+    total = len(planon_asset_group_ids)
 
-    index = 0
-    chunk_size = 100
     planon_asset_groups = []
-    for planon_asset_group_id in planon_asset_group_ids:
-        end_chunk = index + chunk_size if index + chunk_size < len(planon_asset_group_ids) else len(planon_asset_group_ids)
-        if index % chunk_size == 0:
-            log.info(f"Processing chunk {index} through {end_chunk}")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for index in range(0, total, chunk_size):
+            chunk = planon_asset_group_ids[index:index + chunk_size]
+
+            # One token for the whole chunk
+            token = get_token()
+            futures = [executor.submit(read_pln_asset_group, token, planon_asset_group_id) for planon_asset_group_id in chunk]
 
-        planon_asset_groups.append(zeep.helpers.serialize_object(pln_item_group_client.read(get_token(),planon_asset_group_id), dict))
-        index += 1
+            for future in as_completed(futures):
+                planon_asset_groups.append(future.result())
+
+            log.info(f"Read {len(planon_asset_groups)} of {total} planon asset groups")
 
     return planon_asset_groups
 
 
 def get_planon_location(property_code: int, space_number: str) -> tuple():
-    pln_property_ids = pln_property_client.find(get_token(),{
-        'fieldFilters': [{
-            'fieldName': 'Code',
-            'filterValue': property_code,
-            'operator': 'equals'
-        }]
-    })
-
-    if len(pln_property_ids) == 1:
-        pln_space_ids = pln_space_client.find(get_token(), {
+    with planon_limiter.slot():
+        pln_property_ids = get_pln_service('Property').find(get_token(),{
             'fieldFilters': [{
                 'fieldName': 'Code',
-                'filterValue': space_number,
-                'operator': 'equals'
-            },
-            {
-                'fieldName': 'PropertyRef',
-                'filterValue': pln_property_ids[0],
+                'filterValue': property_code,
                 'operator': 'equals'
             }]
         })
+
+    if len(pln_property_ids) == 1:
+        with planon_limiter.slot():
+            pln_space_ids = get_pln_service('Space').find(get_token(), {
+                'fieldFilters': [{
+                    'fieldName': 'Code',
+                    'filterValue': space_number,
+                    'operator': 'equals'
+                },
+                {
+                    'fieldName': 'PropertyRef',
+                    'filterValue': pln_property_ids[0],
+                    'operator': 'equals'
+                }]
+            })
         if len(pln_space_ids) == 1:
             return pln_property_ids[0], pln_space_ids[0]
         else:
@@ -138,9 +235,7 @@ def get_planon_location(property_code: int, space_number: str) -> tuple():
 
 
 
-def update_asset(asset_id: int, code: str, name: str, property_ref: int, parent_ref: int=None, comments: str=None, asset_group: int =None, space_ref: int=None, start_date: date = None, attributes: dict = None) -> json:
-    log.debug(f"Updating asset {code}")
-
+def asset_body(code: str, name: str, property_ref: int, parent_ref: int=None, comments: str=None, asset_group: int =None, space_ref: int=None, start_date: date = None, attributes: dict = None) -> dict:
     body = {
         "code": code,
         "name": name,
@@ -163,14 +258,78 @@ def update_asset(asset_id: int, code: str, name: str, property_ref: int, parent_
             "NSJACKID": attributes['jack'],
         }
 
-    if attributes.get('cable_type'):
-        body['attributes']["NSCABLETYPE"] = attributes['cable_type']
+        if attributes.get('cable_type'):
+            body['attributes']["NSCABLETYPE"] = attributes['cable_type']
+
+        if attributes.get('legacy_patch'):
+            body['attributes']["NSLEGACYPATCH"] = attributes['legacy_patch']
+
+    return body
+
+
+def same_value(current, value) -> bool:
+    # Dates and numbers come back from the REST API as strings
+    return current == value or (current is not None and value is not None and str(current) == str(value))
+
+
+def asset_changes(current: dict, body: dict) -> dict:
+    # The part of body that differs from the fetched asset, attributes are compared one by one
+    changes = {}
+    for field, value in body.items():
+        if field == 'attributeSet':
+            # Sent along with changed attributes only
+            continue
+        if field == 'attributes':
+            current_attributes = current.get('attributes') or {}
+            changed_attributes = {name: attribute for name, attribute in value.items() if not same_value(current_attributes.get(name), attribute)}
+            if changed_attributes:
+                changes['attributes'] = changed_attributes
+        elif not same_value(current.get(field), value):
+            changes[field] = value
 
-    if attributes.get('legacy_patch'):
-        body['attributes']["NSLEGACYPATCH"] = attributes['legacy_patch']
+    if 'attributes' in changes:
+        changes['attributeSet'] = body['attributeSet']
+    return changes
+
+
+def asset_state(pln_asset) -> dict:
+    # The UsrAsset record from the bulk find in REST body terms. Only fields the record
+    # carries are included, a missing one compares as changed unless the body leaves it empty
+    state = {field: getattr(pln_asset, name) for field, name in asset_state_fields.items() if hasattr(pln_asset, name)}
+    state['attributes'] = {name: getattr(pln_asset, name) for name in asset_attribute_fields if hasattr(pln_asset, name)}
+    return state
+
+
+def update_asset(asset_id: int, code: str, name: str, property_ref: int, parent_ref: int=None, comments: str=None, asset_group: int =None, space_ref: int=None, start_date: date = None, attributes: dict = None, current: dict = None, partial: bool = False) -> json:
+    # With the asset's current state nothing is sent (None) when no field differs, and with
+    # partial only the fields that differ are sent instead of the whole body
+    log.debug(f"Updating asset {code}")
+
+    body = asset_body(code, name, property_ref, parent_ref, comments, asset_group, space_ref, start_date, attributes)
+
+    if current is not None:
+        changes = asset_changes(current, body)
+        if not changes:
+            return None
+        if partial:
+            return update_asset_fields(asset_id, changes)
 
     log.debug(f"Payload body {body}")
-    response = session.put(url=f"{os.environ.get('PLN_REST_URL')}asset/{asset_id}", json=body)
+    with planon_limiter.slot() as call:
+        response = get_rest_session().put(url=f"{os.environ.get('PLN_REST_URL')}asset/{asset_id}", json=body)
+        call.status = response.status_code
+
+    return response
+
+
+def update_asset_fields(asset_id: int, changes: dict):
+    if not changes:
+        return None
+
+    log.debug(f"Partial payload {changes}")
+    with planon_limiter.slot() as call:
+        response = get_rest_session().request(partial_update_method, url=f"{os.environ.get('PLN_REST_URL')}asset/{asset_id}", json=changes)
+        call.status = response.status_code
 
     return response
 
@@ -200,34 +359,195 @@ def create_asset(code: str, name: str, property_ref: int, parent_ref: int=None,
             "NSJACKID": attributes.get('jack', None),
         }
 
-    response = session.post(url=f"{os.environ.get('PLN_REST_URL')}asset", json=body)
+    with planon_limiter.slot() as call:
+        response = get_rest_session().post(url=f"{os.environ.get('PLN_REST_URL')}asset", json=body)
+        call.status = response.status_code
 
     return response
 
 
 def get_asset(id_=None, asset_code=None):
     url = f"{os.environ['PLN_REST_URL']}asset/{id_}"
-    
-    response = session.get(url=url)
+
+    with planon_limiter.slot() as call:
+        response = get_rest_session().get(url=url)
+        call.status = response.status_code
     response.raise_for_status()
 
     return response.json()
 
 
 def get_pln_asset(asset_code):
-    pln_asset_ids = pln_asset_client.find(get_token(),{
-    'fieldFilters': [{
-        'fieldName': 'Code',
-        'filterValue': asset_code,
-        'operator': 'equals'
-        }]
-    })
+    with planon_limiter.slot():
+        pln_asset_ids = get_pln_service('UsrAsset').find(get_token(),{
+        'fieldFilters': [{
+            'fieldName': 'Code',
+            'filterValue': asset_code,
+            'operator': 'equals'
+            }]
+        })
     if len(pln_asset_ids) > 0:
         return pln_asset_ids[0]
     else:
         return None
 
 
+def find_pln_assets(asset_codes: typing.Iterable[str]) -> dict:
+    # code -> UsrAsset record for every existing code, one find on the same business object as
+    # get_pln_asset. The SOAP find returns ids without codes, so the REST SDK answers it
+    asset_filter = {
+        "filter": {
+            "Code": {"in": sorted(set(asset_codes))},
+        }
+    }
+    with planon_limiter.slot(), metrics.time('usrasset_find', 'planon UsrAsset.find'):
+        pln_assets = get_planon_sdk().UsrAsset.find(asset_filter)
+
+    found = {}
+    for pln_asset in pln_assets:
+        # First match, the same as pln_asset_ids[0] in get_pln_asset
+        found.setdefault(pln_asset.Code, pln_asset)
+    return found
+
+
+def get_pln_asset_ids(asset_codes: typing.Iterable[str]) -> dict:
+    # code -> asset id (Syscode) for every existing code
+    return {code: pln_asset.Syscode for code, pln_asset in find_pln_assets(asset_codes).items()}
+
+
+# ============================================================
+# UPSERT
+# Creates or updates the Planon assets for a stream of transformed
+# network jacks. Existing codes and locations are resolved once per
+# chunk, then the PUTs / POSTs are sent on a bounded thread pool
+# ============================================================
+
+UpsertResult = namedtuple('UpsertResult', ['jack', 'action', 'asset_id', 'status', 'error'])
+
+
+def asset_arguments(transformed_network_jack: dict, property_ref: int, space_ref: int=None, asset_group: int=None) -> dict:
+    return {
+        'code': transformed_network_jack['jack'],
+        'name': transformed_network_jack['jack'],
+        'property_ref': property_ref,
+        'space_ref': space_ref,
+        'comments': transformed_network_jack['comments'],
+        'asset_group': asset_group,
+        'start_date': transformed_network_jack['wiring_date'],
+        'attributes': {
+            'jack': transformed_network_jack['jack'],
+            'cable_type': transformed_network_jack['cable_type'],
+            'legacy_patch': transformed_network_jack['legacy_patch'],
+        },
+    }
+
+
+def send_asset(transformed_network_jack: dict, asset_id: int, arguments: dict, retries: int = 3, backoff: float = 0.5, current: dict = None, partial: bool = False) -> UpsertResult:
+    # PUTs are retried by the transport and sent once here. POSTs are not retried
+    # by the transport, they are retried here after re-checking the code, so a
+    # create that landed before a dropped connection or a 5xx becomes an update
+    # instead of a duplicate.
+    # Any other error (a failed re-check, a bad argument) fails this jack only
+    action = 'updated' if asset_id else 'created'
+    for attempt in range(retries + 1):
+        try:
+            if attempt:
+                asset_id = get_pln_asset_ids([arguments['code']]).get(arguments['code'])
+            action = 'updated' if asset_id else 'created'
+
+            with metrics.time('asset_upsert'):
+                if asset_id:
+                    response = update_asset(asset_id, **arguments, current=current, partial=partial)
+                else:
+                    response = create_asset(**arguments)
+
+            if response is None:
+                return UpsertResult(transformed_network_jack, 'unchanged', asset_id, None, None)
+
+            if response.status_code in retry_statuses and attempt < retries and action == 'created':
+                raise requests.HTTPError(f"{response.status_code} from Planon", response=response)
+
+            response.raise_for_status()
+            return UpsertResult(transformed_network_jack, action, asset_id, response.status_code, None)
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+            status = e.response.status_code if e.response is not None else None
+            if action == 'updated' or attempt == retries or (status is not None and status not in retry_statuses):
+                return UpsertResult(transformed_network_jack, action, asset_id, status, e)
+
+            log.debug(f"Retrying {action[:-1]} of {arguments['code']} after {repr(e)}")
+            time.sleep(random.uniform(0, backoff * 2 ** attempt))
+        except Exception as e:
+            return UpsertResult(transformed_network_jack, action, asset_id, error_status(e), e)
+
+
+def upsert_chunk(executor: ThreadPoolExecutor, chunk: list, locations: dict, asset_group: int, retries: int, partial: bool = False) -> typing.Iterator[UpsertResult]:
+    # Existing codes of the whole chunk in one find, new locations concurrently alongside it
+    codes = {jack['jack'] for jack in chunk}
+    new_locations = {(jack['building_ref'], jack['space_id']) for jack in chunk} - locations.keys()
+
+    asset_future = executor.submit(find_pln_assets, codes)
+    location_futures = {location: executor.submit(get_planon_location, *location) for location in new_locations}
+
+    # The found records double as the current state the updates are compared with
+    current_assets = {}
+    try:
+        found = asset_future.result()
+        asset_ids = {code: found[code].Syscode if code in found else None for code in codes}
+        current_assets = {code: asset_state(pln_asset) for code, pln_asset in found.items()}
+    except Exception as e:
+        asset_ids = dict.fromkeys(codes, e)
+    # Only found locations are remembered, a failed lookup fails this chunk's jacks and is tried again by the next chunk
+    location_errors = {}
+    for location, future in location_futures.items():
+        try:
+            locations[location] = future.result()
+        except Exception as e:
+            location_errors[location] = e
+
+    futures = []
+    for jack in chunk:
+        asset_id = asset_ids[jack['jack']]
+        location = location_errors.get((jack['building_ref'], jack['space_id'])) or locations[(jack['building_ref'], jack['space_id'])]
+        if isinstance(asset_id, Exception):
+            yield UpsertResult(jack, None, None, None, asset_id)
+        elif isinstance(location, Exception):
+            yield UpsertResult(jack, None, asset_id, None, location)
+        elif location[0] is None:
+            yield UpsertResult(jack, None, asset_id, None, LookupError(f"No Planon property found for code {jack['building_ref']}"))
+        else:
+            arguments = asset_arguments(jack, location[0], location[1], asset_group)
+            futures.append(executor.submit(send_asset, jack, asset_id, arguments, retries, current=current_assets.get(jack['jack']), partial=partial))
+
+    for future in as_completed(futures):
+        yield future.result()
+
+
+def upsert_assets(transformed_network_jacks: typing.Iterable[dict], asset_group: int=None, workers: int = upsert_workers, chunk_size: int = 100, retries: int = 3, partial: bool = False) -> typing.Iterator[UpsertResult]:
+    # Yields one UpsertResult per jack as its request completes, in completion order.
+    # An existing asset whose fields already match gets no request, action 'unchanged'. The others get
+    # the full PUT, or with partial only the fields that differ
+    locations = {}
+    jacks = iter(transformed_network_jacks)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            chunk = list(islice(jacks, chunk_size))
+            if not chunk:
+                return
+
+            # A code repeated in a chunk waits for the first one, so it updates instead of creating twice
+            while chunk:
+                seen = set()
+                batch = []
+                repeated = []
+                for jack in chunk:
+                    (repeated if jack['jack'] in seen else batch).append(jack)
+                    seen.add(jack['jack'])
+
+                yield from upsert_chunk(executor, batch, locations, asset_group, retries, partial)
+                chunk = repeated
+
+
 def validate_network_jack(source_network_jack: dict) -> tuple():
     issues: list = []
 
@@ -240,7 +560,7 @@ def validate_network_jack(source_network_jack: dict) -> tuple():
         errors += 1
 
         issues.append("Missing building ref")
-    elif source_network_jack['building_ref'] and str(source_network_jack['building_ref']).zfill(4) not in property_codes:
+    elif source_network_jack['building_ref'] and str(source_network_jack['building_ref']).zfill(4) not in get_property_code_index():
         errors += 1
 
         issues.append("Invalid building code")
@@ -283,7 +603,7 @@ def validate_network_jack(source_network_jack: dict) -> tuple():
     # RULE 7:
     # Verify the space is a valid Planon space
     space_code = f"{str(source_network_jack['building_ref']).zfill(4)}-{source_network_jack['space_id']}"
-    if space_code not in space_codes:
+    if space_code not in get_space_code_index():
         warnings += 1
 
         issues.append("Space is not a valid Planon space")
@@ -315,47 +635,176 @@ def transform_network_jack(source_network_jack: dict) -> dict:
         return transformed_network_jack
 
 
+# ============================================================
+# BATCH VALIDATION
+# Same rules and transform as validate_network_jack and
+# transform_network_jack, applied column by column to a batch of
+# jacks given as {field: [values]}
+# ============================================================
+
+# Issue text per rule check, in the order validate_network_jack reports them
+jack_error_rules = ["Missing building ref", "Invalid building code", "Jack is is null or empty", "Jack ID is null or empty"]
+jack_warning_rules = ["Space in jack", "Space in jack id", "Invalid ethernet cable category", "Space is not a valid Planon space"]
+jack_rules = jack_error_rules + jack_warning_rules
+
+
+def validate_network_jacks(network_jacks: dict) -> dict:
+    # Returns {'rules': {issue: [bool per jack]}, 'issues', 'warnings', 'errors'}, the last three per jack
+    property_codes = get_property_code_index()
+    space_codes = get_space_code_index()
+
+    building_refs = network_jacks['building_ref']
+    jacks = network_jacks['jack']
+    jack_ids = network_jacks['jack_id']
+    padded_building_refs = [str(building_ref).zfill(4) for building_ref in building_refs]
+
+    missing_building = [not building_ref for building_ref in building_refs]
+    rules = {
+        "Missing building ref": missing_building,
+        "Invalid building code": [not missing and padded not in property_codes for missing, padded in zip(missing_building, padded_building_refs)],
+        "Jack is is null or empty": [not jack or jack.isspace() for jack in jacks],
+        "Jack ID is null or empty": [not jack_id or jack_id.isspace() for jack_id in jack_ids],
+        "Space in jack": [bool(jack) and " " in jack for jack in jacks],
+        "Space in jack id": [bool(jack_id) and " " in jack_id for jack_id in jack_ids],
+        "Invalid ethernet cable category": [bool(cable_type) and cable_type.upper() not in ethernet_categories for cable_type in network_jacks['cable_type']],
+        "Space is not a valid Planon space": [f"{padded}-{space_id}" not in space_codes for padded, space_id in zip(padded_building_refs, network_jacks['space_id'])],
+    }
+
+    flags = zip(*(rules[rule] for rule in jack_rules))
+
+    return {
+        'rules': rules,
+        'issues': [[rule for rule, flagged in zip(jack_rules, jack_flags) if flagged] if any(jack_flags) else [] for jack_flags in flags],
+        'errors': list(map(sum, zip(*(rules[rule] for rule in jack_error_rules)))),
+        'warnings': list(map(sum, zip(*(rules[rule] for rule in jack_warning_rules)))),
+    }
+
+
+def transform_network_jacks(network_jacks: dict) -> tuple:
+    # Returns (validation, transformed), transformed holds None where transform_network_jack would return None
+    validation = validate_network_jacks(network_jacks)
+    size = len(network_jacks['id'])
+    wiring_dates = network_jacks.get('wiring_date') or [None] * size
+
+    transformed = []
+    for index, errors in enumerate(validation['errors']):
+        if errors:
+            transformed.append(None)
+            continue
+
+        transformed.append({
+            'id': network_jacks['id'][index],
+            'building_ref': str(network_jacks['building_ref'][index]).zfill(4),
+            'jack': f"{''.join(network_jacks['jack'][index].split())}-{' '.join(network_jacks['jack_id'][index].split())}",
+            'comments': network_jacks['comments'][index],
+            'legacy_patch': network_jacks['legacy_patch'][index],
+            'space_id': None if validation['rules']["Space is not a valid Planon space"][index] else network_jacks['space_id'][index],
+            'cable_type': network_jacks['cable_type'][index],
+            'wiring_date': wiring_dates[index].isoformat() if wiring_dates[index] else None,
+        })
+
+    return validation, transformed
+
+
+def network_jack_columns(source_network_jacks: typing.Iterable[dict]) -> dict:
+    # Row dicts -> {field: [values]}
+    source_network_jacks = list(source_network_jacks)
+    fields = ['id', 'building_ref', 'jack', 'jack_id', 'comments', 'legacy_patch', 'space_id', 'cable_type', 'wiring_date']
+    return {field: [source_network_jack.get(field) for source_network_jack in source_network_jacks] for field in fields}
+
+
 # ============================================================
 # CACHING
 # ============================================================
 
-jwt = login_jwt(f"{os.environ.get('API_BASE_URL')}/jwt", os.environ.get("API_KEY"), "api:facilities:properties:read")
+def get_dartmouth_properties():
+    return get_resource_by_query(f"{os.environ.get('API_BASE_URL')}/facilities/properties", get_jwt(), workers=8)
+
+
+def get_dartmouth_spaces():
+    return get_resource_by_query(f"{os.environ.get('API_BASE_URL')}/facilities/spaces", get_jwt(), workers=8)
+
+
+# Reference data is stored columnar and memory mapped, see columnar.py, and kept current between
+# full loads by change_feed.py. Spaces keep their id so changes can find them
+properties_cache = SnapshotCache("properties", get_dartmouth_properties, fields=['id'], ttl=properties_cache_ttl, columnar=True)
+spaces_cache = SnapshotCache("spaces", get_dartmouth_spaces, fields=['id', 'property_id', 'number'], ttl=spaces_cache_ttl, columnar=True)
+asset_groups_cache = SnapshotCache("asset_groups", get_pln_asset_groups, fields=['Syscode', 'Code', 'Name'], ttl=asset_groups_cache_ttl)
+
 
 # Dartmouth Properties
-if os.path.exists(properties_cache_path):
-    with open(properties_cache_path, "rb") as file:
-        properties = pickle.load(file)
+@lazy
+def get_properties():
+    return properties_cache.load()
 
-    property_codes = [code['id'] for code in properties]
-else:
-    properties = get_resource_by_query(f"{os.environ.get('API_BASE_URL')}/facilities/properties", jwt)
-    property_codes = [code['id'] for code in properties]
 
-    with open(properties_cache_path, "wb") as file:
+@lazy
+def get_property_codes():
+    return get_properties().column('id')
 
-        pickle.dump(properties, file)
 
 # Dartmouth Spaces
-if os.path.exists(spaces_cache_path):
-    with open(spaces_cache_path, "rb") as file:
-        spaces = pickle.load(file)
+@lazy
+def get_spaces():
+    return spaces_cache.load()
+
+
+@lazy
+def get_space_codes():
+    return [f"{property_id}-{number}" for property_id, number in zip(get_spaces().column('property_id'), get_spaces().column('number'))]
+
 
-    space_codes = [f"{code['property_id']}-{code['number']}" for code in spaces]
-else:
-    spaces = get_resource_by_query(f"{os.environ.get('API_BASE_URL')}/facilities/spaces", jwt)
-    space_codes = [f"{code['property_id']}-{code['number']}" for code in spaces]
+# Hashed indexes for membership checks
+@lazy
+def get_property_code_index():
+    return frozenset(get_property_codes())
 
-    with open(spaces_cache_path, "wb") as file:
 
-        pickle.dump(spaces, file)
+@lazy
+def get_space_code_index():
+    return frozenset(get_space_codes())
+
 
 # Planon Asset Groups
-if os.path.exists(asset_group_cache_path):
-    with open(asset_group_cache_path, "rb") as file:
-        planon_asset_groups = pickle.load(file)
-else:
-    planon_asset_groups = get_pln_asset_groups()
+@lazy
+def get_planon_asset_groups():
+    return asset_groups_cache.load().dicts()
+
+
+reference_caches = {
+    'properties': properties_cache,
+    'spaces': spaces_cache,
+    'asset_groups': asset_groups_cache,
+}
+
+
+def refresh_reference_data(names: typing.Iterable[str] = None):
+    # Reloads the named caches (all by default) in full, whatever their age, and drops the in-memory copies
+    for name in names or reference_caches:
+        reference_caches[name].refresh()
+
+    for accessor in (get_properties, get_property_codes, get_spaces, get_space_codes, get_property_code_index, get_space_code_index, get_planon_asset_groups):
+        accessor.reset()
+
+
+# The module level names used before setup became lazy
+lazy_attributes = {
+    'session': get_rest_session,
+    'pln_client': get_pln_client,
+    'pln_asset_client': lambda: get_pln_service('UsrAsset'),
+    'pln_property_client': lambda: get_pln_service('Property'),
+    'pln_space_client': lambda: get_pln_service('Space'),
+    'pln_item_group_client': lambda: get_pln_service('ItemGroup'),
+    'jwt': get_jwt,
+    'properties': get_properties,
+    'property_codes': get_property_codes,
+    'spaces': get_spaces,
+    'space_codes': get_space_codes,
+    'planon_asset_groups': get_planon_asset_groups,
+}
 
-    with open(asset_group_cache_path, "wb") as file:
 
-        pickle.dump(planon_asset_groups, file)
\ No newline at end of file
+def __getattr__(name: str):
+    if name in lazy_attributes:
+        return lazy_attributes[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,159 @@
+import csv
+import gzip
+import io
+import logging
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+
+import utils.logger
+
+from metrics import metrics
+
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# READING
+# Rows are streamed straight from the (optionally gzip compressed)
+# CSV, nothing upstream of the current chunks is held in memory
+# ============================================================
+
+def open_csv(path: str):
+    with open(path, 'rb') as file:
+        compressed = file.read(2) == b'\x1f\x8b'
+
+    if compressed:
+        return io.TextIOWrapper(gzip.open(path, 'rb'), newline='')
+    else:
+        return open(path, newline='')
+
+
+def read_rows(path: str, delimiter: str = ',') -> Iterator[dict]:
+    with open_csv(path) as file:
+        reader = csv.DictReader(file, delimiter=delimiter)
+
+        while True:
+            started = time.perf_counter()
+            row = next(reader, None)
+            if row is None:
+                return
+
+            metrics.observe('csv_parse', time.perf_counter() - started)
+            yield row
+
+
+# ============================================================
+# RATE LIMITING
+# Token bucket shared by all workers, max_rps=None disables it
+# ============================================================
+
+class RateLimiter:
+
+    def __init__(self, max_rps: float = None):
+        self.max_rps = max_rps
+        self.interval = 1.0 / max_rps if max_rps else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# ============================================================
+# RESULTS
+# Per-row outcomes are recorded from every worker thread
+# ============================================================
+
+class ImportStats:
+
+    def __init__(self, journal=None, failures=None):
+        self.lock = threading.Lock()
+        self.journal = journal
+        self.failures = failures
+
+        self.failed = []
+        self.success_count = 0
+        self.fail_count = 0
+        self.nobarcode_count = 0
+        self.skipped_count = 0
+
+    def succeeded(self, row: dict):
+        with self.lock:
+            self.success_count += 1
+
+        if self.journal:
+            self.journal.record(row, 'success')
+
+    def skipped(self, row: dict):
+        with self.lock:
+            self.skipped_count += 1
+
+        if self.journal:
+            self.journal.record(row, 'skipped')
+
+    def no_barcode(self, row: dict):
+        with self.lock:
+            self.failed.append({
+                'error': 'No barcode',
+                'asset': row
+            })
+            self.nobarcode_count += 1
+
+        if self.failures:
+            self.failures.no_barcode(row)
+        if self.journal:
+            self.journal.record(row, 'no_barcode')
+
+    def fail(self, row: dict, error: Exception):
+        with self.lock:
+            self.failed.append({
+                'error': repr(error),
+                'asset': row,
+            })
+            self.fail_count += 1
+
+        if self.failures:
+            self.failures.fail(row, error)
+        if self.journal:
+            self.journal.record(row, 'failed')
+
+
+# ============================================================
+# EXECUTION
+# ============================================================
+
+def run_concurrently(items: Iterable, func: Callable, workers: int = 1):
+    # Runs func over items with at most workers calls in flight, items are consumed lazily
+    if workers <= 1:
+        for item in items:
+            func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for item in items:
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+
+            in_flight.add(executor.submit(func, item))
+
+        for future in wait(in_flight).done:
+            future.result()
@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+import threading
+
+from collections import Counter
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+
+import utils.logger
+
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# JOURNAL
+# Append-only record of processed rows, one JSON line per row.
+# Lines are buffered and written with a single fsync per batch,
+# a torn last line from a crash is dropped when resuming.
+# Only rows with a final outcome are skipped on resume, failed rows
+# (often failed by whatever ended the run) are processed again.
+# ============================================================
+
+final_outcomes = frozenset(['success', 'skipped', 'no_barcode'])
+
+
+class Journal:
+
+    def __init__(self, path: str, row_key: Callable, resume: bool = False, flush_every: int = 500):
+        self.path = path
+        self.row_key = row_key
+        self.flush_every = flush_every
+
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.committed = Counter()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if resume and os.path.exists(path):
+            self.load()
+            self.file = open(path, 'a')
+        else:
+            self.file = open(path, 'w')
+
+    def load(self):
+        with open(self.path, 'rb') as file:
+            data = file.read()
+
+        # Cut a partially written last line so appends start on a clean line
+        complete = data[:data.rfind(b'\n') + 1]
+        if len(complete) != len(data):
+            log.warning(f"Dropping truncated last line of journal {self.path}")
+            with open(self.path, 'r+b') as file:
+                file.truncate(len(complete))
+
+        for line in complete.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                log.warning(f"Skipping unreadable journal line {line[:80]!r}")
+                continue
+
+            if entry.get('outcome') in final_outcomes:
+                self.committed[entry['key']] += 1
+
+        log.info(f"Resuming from journal {self.path} with {sum(self.committed.values())} committed rows")
+
+    def committed_filter(self) -> Callable:
+        # failure -> True for as many failures of a key as the key has committed rows
+        remaining = Counter(self.committed)
+
+        def committed(failure: dict) -> bool:
+            key = self.row_key(failure['row'])
+            if remaining[key] > 0:
+                remaining[key] -= 1
+                return True
+            return False
+
+        return committed
+
+    def pending(self, rows: Iterable[dict]) -> Iterator[dict]:
+        # Skips the first n occurrences of every key committed n times in the previous run
+        skipped = 0
+        for row in rows:
+            key = self.row_key(row)
+            if self.committed[key] > 0:
+                self.committed[key] -= 1
+                skipped += 1
+                continue
+
+            yield row
+
+        if skipped:
+            log.info(f"Skipped {skipped} rows already committed to the journal")
+
+    def record(self, row: dict, outcome: str):
+        line = json.dumps({'key': self.row_key(row), 'outcome': outcome}, separators=(',', ':'))
+
+        with self.lock:
+            self.buffer.append(line)
+            if len(self.buffer) >= self.flush_every:
+                self.flush_locked()
+
+    def flush_locked(self):
+        if not self.buffer:
+            return
+
+        self.file.write('\n'.join(self.buffer) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.buffer = []
+
+    def close(self):
+        with self.lock:
+            self.flush_locked()
+            self.file.close()
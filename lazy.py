@@ -0,0 +1,28 @@
+import functools
+import threading
+
+# ============================================================
+# LAZY
+# Memoizes a zero-argument setup function on first call. Callers
+# racing on the first call wait for the single initialization.
+# ============================================================
+
+def lazy(func):
+    lock = threading.Lock()
+    state = {}
+
+    @functools.wraps(func)
+    def wrapper():
+        if 'value' not in state:
+            with lock:
+                if 'value' not in state:
+                    state['value'] = func()
+        return state['value']
+
+    def reset():
+        with lock:
+            state.clear()
+
+    wrapper.reset = reset
+    wrapper.initialized = lambda: 'value' in state
+    return wrapper
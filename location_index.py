@@ -0,0 +1,138 @@
+import logging
+import threading
+
+from typing import Iterable
+from typing import Tuple
+from typing import Union
+
+import planon
+
+import utils.logger
+
+from concurrency import planon_limiter
+from metrics import metrics
+
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# LOCATION INDEX
+# Planon properties are pulled in one call, spaces are pulled in
+# chunks of properties, and every (property_code, space_code)
+# lookup is answered from memory afterwards, including misses.
+# ============================================================
+
+class LocationIndex:
+
+    def __init__(self, chunk_size: int = 100, rate_limiter=None):
+        self.chunk_size = chunk_size
+        self.rate_limiter = rate_limiter
+
+        self.property_syscodes = None     # property code -> syscode
+        self.locations = {}               # (property code, space code) -> (property syscode, space syscode)
+        self.loaded_properties = set()    # property codes whose spaces are already indexed
+
+        self.hits = 0
+        self.misses = 0
+        self.api_calls = 0
+
+        self.lock = threading.RLock()
+
+    def load_properties(self):
+        log.info("Loading Planon properties into location index")
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        with planon_limiter.slot(), metrics.time('property_find', 'planon Property.find'):
+            pln_properties = planon.Property.find()
+        self.api_calls += 1
+
+        self.property_syscodes = {pln_property.Code: pln_property.Syscode for pln_property in pln_properties}
+        log.info(f"Indexed {len(self.property_syscodes)} Planon properties")
+
+    def load_snapshot(self, properties, spaces):
+        # Fills the whole index from local snapshots, (Code, Syscode) and (Code, PropertyRef, Syscode) records
+        with self.lock:
+            self.property_syscodes = {code: syscode for code, syscode in properties}
+            property_codes = {syscode: code for code, syscode in self.property_syscodes.items()}
+
+            for code, property_ref, syscode in spaces:
+                property_code = property_codes.get(property_ref)
+                if property_code is not None:
+                    self.locations.setdefault((property_code, code), (property_ref, syscode))
+
+            self.loaded_properties.update(self.property_syscodes)
+            log.info(f"Indexed {len(self.property_syscodes)} Planon properties and {len(spaces)} spaces from snapshots")
+
+    def prefetch(self, property_codes: Iterable[str]):
+        with self.lock:
+            if self.property_syscodes is None:
+                self.load_properties()
+
+            pending = {}
+            for property_code in set(property_codes):
+                if property_code in self.loaded_properties:
+                    continue
+
+                property_syscode = self.property_syscodes.get(property_code)
+                if property_syscode is not None:
+                    pending[property_syscode] = property_code
+                else:
+                    # Unknown to Planon, there are no spaces to load
+                    self.loaded_properties.add(property_code)
+
+            syscodes = list(pending)
+            for index in range(0, len(syscodes), self.chunk_size):
+                chunk = syscodes[index:index + self.chunk_size]
+                log.info(f"Loading Planon spaces for properties {index} through {index + len(chunk)} of {len(syscodes)}")
+
+                space_filter = {
+                    "filter": {
+                        "PropertyRef": {"in": chunk},
+                    }
+                }
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                with planon_limiter.slot(), metrics.time('space_find', 'planon Space.find'):
+                    pln_spaces = planon.Space.find(space_filter)
+                self.api_calls += 1
+
+                for pln_space in pln_spaces:
+                    key = (pending[pln_space.PropertyRef], pln_space.Code)
+                    # Keep the first match, the same as pln_spaces[0] in a per-row find
+                    self.locations.setdefault(key, (pln_space.PropertyRef, pln_space.Syscode))
+
+                # Only after the find succeeded, a failed chunk is loaded again on its next lookup
+                self.loaded_properties.update(pending[syscode] for syscode in chunk)
+
+    def get(self, property_code: str, space_number: str = '') -> Tuple[int, Union[int, None]]:
+        with metrics.time('planon_location'):
+            return self.lookup(property_code, space_number)
+
+    def lookup(self, property_code: str, space_number: str = '') -> Tuple[int, Union[int, None]]:
+        key = (property_code, space_number or '')
+
+        with self.lock:
+            location = self.locations.get(key)
+
+            if location is not None:
+                self.hits += 1
+            else:
+                if property_code in self.loaded_properties:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                    self.prefetch([property_code])
+
+                location = self.locations.get(key)
+                if location is None:
+                    # Negative entry, missing spaces (and missing properties) are remembered too
+                    location = (self.property_syscodes.get(property_code), None)
+                    self.locations[key] = location
+
+        if location[0] is None:
+            raise Exception(f"No Planon property found for code {property_code}")
+
+        return location
+
+    def log_stats(self):
+        log.info(f"Location index lookups : {self.hits} hits, {self.misses} misses, {self.api_calls} API calls")
@@ -1,15 +1,106 @@
+import atexit
+import itertools
+import json
+import os
+import queue
 import sys
+import threading
 import time
 import logging
 
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+
 # ******************************************************************************************************************
 # Logging
+#   LOG_LEVEL               root level, INFO by default
+#   LOG_FORMAT              text (default) or json, one JSON object per line
+#   LOG_ASYNC               1 to format and write records on a background thread
+#   LOG_ROW_SAMPLE          fraction of per-row lines kept, 0.01 keeps one in a hundred
+#   LOG_ROW_MAX_PER_SECOND  cap on per-row lines per second, 0 for no cap
+# Per-row lines go through get_row_logger(), warnings and errors are never sampled or capped
 # ******************************************************************************************************************
 
-log_level = 'INFO'
+log_level = os.environ.get('LOG_LEVEL', 'INFO')
 log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+log_json = os.environ.get('LOG_FORMAT', 'text').lower() == 'json'
+log_async = os.environ.get('LOG_ASYNC', '').lower() not in ('', '0', 'false', 'no')
+
+row_sample_rate = float(os.environ.get('LOG_ROW_SAMPLE', 1.0))
+row_max_per_second = float(os.environ.get('LOG_ROW_MAX_PER_SECOND', 0))
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        document = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            document['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(document, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    # Hands the record over as is, message and time formatting happen on the listener thread
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class RowSampler(logging.Filter):
+    # Keeps one in every 1/sample_rate records and at most max_per_second of them
+
+    def __init__(self, sample_rate: float = 1.0, max_per_second: float = 0):
+        super().__init__()
+        self.every = max(1, round(1 / sample_rate)) if 0 < sample_rate < 1 else 1
+        self.counter = itertools.count()
+        self.max_per_second = max_per_second
+
+        self.lock = threading.Lock()
+        self.tokens = max_per_second
+        self.last = time.monotonic()
+        self.dropped = 0
 
-logging.basicConfig(stream = sys.stdout, level = log_level, format = log_format)
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        if self.every > 1 and next(self.counter) % self.every:
+            self.dropped += 1
+            return False
+
+        if self.max_per_second:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.max_per_second, self.tokens + (now - self.last) * self.max_per_second)
+                self.last = now
+                if self.tokens < 1:
+                    self.dropped += 1
+                    return False
+                self.tokens -= 1
+
+        return True
+
+
+stream_handler = logging.StreamHandler(sys.stdout)
+stream_handler.setFormatter(JsonFormatter() if log_json else logging.Formatter(log_format))
+
+if log_async:
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    handlers = [DeferredQueueHandler(log_queue)]
+else:
+    handlers = [stream_handler]
+
+logging.basicConfig(level = log_level, handlers = handlers)
 
 # Set the log to use GMT time zone
 logging.Formatter.converter = time.gmtime
@@ -17,6 +108,23 @@ logging.Formatter.converter = time.gmtime
 # Add milliseconds
 logging.Formatter.default_msec_format = '%s.%03d'
 
+# One sampler for every row logger, so the per-second cap is process wide
+row_sampler = RowSampler(row_sample_rate, row_max_per_second)
+
+
+def get_row_logger(name: str) -> logging.Logger:
+    # Logger for the lines written once per CSV row, <name>.rows
+    row_log = logging.getLogger(f"{name}.rows")
+    if row_sampler not in row_log.filters:
+        row_log.addFilter(row_sampler)
+    return row_log
+
+
+def log_row_stats():
+    if row_sampler.dropped:
+        log.info(f"Per-row log lines sampled out : {row_sampler.dropped}")
+
+
 # Create
 log = logging.getLogger(__name__)
-log.debug('Logging started')
\ No newline at end of file
+log.debug('Logging started')
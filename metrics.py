@@ -0,0 +1,189 @@
+import json
+import logging
+import threading
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import utils.logger
+
+from storage import write_atomic
+
+
+log = logging.getLogger(__name__)
+
+# Upper bounds in seconds, the last bucket is +Inf
+buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+prefix = 'assets_import'
+
+# ============================================================
+# HISTOGRAM
+# ============================================================
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return buckets[index] if index < len(buckets) else float('inf')
+        return float('inf')
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'sum_seconds': round(self.sum, 6),
+            'mean_ms': round(self.sum / self.count * 1000, 3) if self.count else 0.0,
+            'p50_le_seconds': self.quantile(0.5),
+            'p99_le_seconds': self.quantile(0.99),
+        }
+
+
+# ============================================================
+# METRICS
+# Per-stage latency histograms and per-endpoint call, byte and
+# error counters, written as JSON and as a Prometheus textfile
+# ============================================================
+
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+        self.stages = {}
+        self.calls = {}
+        self.errors = {}
+        self.bytes = {}
+        self.gauges = {}
+
+        self.writer = None
+        self.stopping = threading.Event()
+
+    def observe(self, stage: str, seconds: float, error: bool = False):
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+            if error:
+                histogram.errors += 1
+
+    def count(self, endpoint: str, size: int = 0, error: bool = False):
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            self.bytes[endpoint] = self.bytes.get(endpoint, 0) + size
+            if error:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def gauge(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def time(self, stage: str, endpoint: str = None):
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - started, error)
+            if endpoint:
+                self.count(endpoint, error=error)
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                'started': self.started,
+                'elapsed_seconds': round(time.time() - self.started, 3),
+                'stages': {stage: histogram.summary() for stage, histogram in sorted(self.stages.items())},
+                'endpoints': {
+                    endpoint: {
+                        'calls': calls,
+                        'errors': self.errors.get(endpoint, 0),
+                        'bytes': self.bytes.get(endpoint, 0),
+                    }
+                    for endpoint, calls in sorted(self.calls.items())
+                },
+                'gauges': dict(sorted(self.gauges.items())),
+            }
+
+    def prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            lines.append(f"# TYPE {prefix}_stage_seconds histogram")
+            for stage, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+            lines.append(f"# TYPE {prefix}_stage_errors_total counter")
+            for stage, histogram in sorted(self.stages.items()):
+                lines.append(f'{prefix}_stage_errors_total{{stage="{stage}"}} {histogram.errors}')
+
+            for name, values in (('api_calls_total', self.calls), ('api_errors_total', self.errors), ('api_bytes_total', self.bytes)):
+                lines.append(f"# TYPE {prefix}_{name} counter")
+                for endpoint, value in sorted(values.items()):
+                    lines.append(f'{prefix}_{name}{{endpoint="{endpoint}"}} {value}')
+
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"# TYPE {prefix}_{name} gauge")
+                lines.append(f"{prefix}_{name} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_path: str = None, prometheus_path: str = None):
+        if json_path:
+            write_atomic(json_path, json.dumps(self.summary(), indent=2))
+        if prometheus_path:
+            write_atomic(prometheus_path, self.prometheus())
+
+    def start_writer(self, json_path: str = None, prometheus_path: str = None, interval: float = 60):
+        if not (json_path or prometheus_path):
+            return
+
+        def run():
+            while not self.stopping.wait(interval):
+                try:
+                    self.write(json_path, prometheus_path)
+                except Exception as e:
+                    log.error(f"Could not write metrics: {repr(e)}")
+
+        self.writer = threading.Thread(target=run, name='metrics-writer', daemon=True)
+        self.writer.start()
+
+    def stop_writer(self, json_path: str = None, prometheus_path: str = None):
+        self.stopping.set()
+        if self.writer:
+            self.writer.join()
+        self.write(json_path, prometheus_path)
+
+
+# Process wide registry
+metrics = Metrics()
@@ -0,0 +1,139 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import zlib
+
+from collections import Counter
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+import utils.logger
+
+from storage import write_atomic
+
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# FUNCTIONS
+# A row belongs to shard crc32(BUILDING_ID) % K, stable across
+# runs, machines and Python versions, and every row of a building
+# lands in the same shard so its location lookups stay local
+# ============================================================
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    # "i/K" with 0 <= i < K
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/K, got {value!r}")
+
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in 0..{count - 1}, got {value!r}")
+    return index, count
+
+
+def shard_of(value: str, count: int) -> int:
+    return zlib.crc32(str(value).encode()) % count
+
+
+def shard_rows(rows: Iterable[dict], key: Callable, shard: Tuple[int, int]) -> Iterator[dict]:
+    index, count = shard
+    return (row for row in rows if shard_of(key(row), count) == index)
+
+
+def shard_path(path: str, shard: Tuple[int, int]) -> str:
+    # output/update_asset.failures.jsonl -> output/update_asset.failures.shard-2-of-8.jsonl
+    if not path or not shard:
+        return path
+
+    root, extension = os.path.splitext(path)
+    return f"{root}.shard-{shard[0]}-of-{shard[1]}{extension}"
+
+
+# ============================================================
+# SHARD PROCESSES
+# ============================================================
+
+def without_option(argv: List[str], option: str) -> List[str]:
+    # argv minus "--option value" / "--option=value"
+    result = []
+    skip = False
+    for argument in argv:
+        if skip:
+            skip = False
+        elif argument == option:
+            skip = True
+        elif not argument.startswith(f"{option}="):
+            result.append(argument)
+    return result
+
+
+def remove_shard_files(paths: Iterable[str], count: int):
+    # Shard files of an earlier run would otherwise be merged as this run's
+    for path in paths:
+        for index in range(count):
+            shard_file = shard_path(path, (index, count))
+            if os.path.exists(shard_file):
+                os.remove(shard_file)
+
+
+def run_shards(script: str, argv: List[str], count: int, outputs: Iterable[str] = ()) -> List[int]:
+    # One child process per shard, each running the same script with --shard i/K.
+    # The shard copies of outputs (results, failure queue) are removed first
+    remove_shard_files(outputs, count)
+
+    argv = without_option(without_option(argv, '--shards'), '--shard')
+    processes = [
+        subprocess.Popen([sys.executable, script, *argv, '--shard', f"{index}/{count}"])
+        for index in range(count)
+    ]
+    log.info(f"Started {count} shard processes")
+
+    exit_codes = [process.wait() for process in processes]
+    for index, exit_code in enumerate(exit_codes):
+        if exit_code:
+            log.error(f"Shard {index}/{count} exited with {exit_code}")
+
+    return exit_codes
+
+
+# ============================================================
+# RESULTS
+# ============================================================
+
+def write_result(path: str, result: dict):
+    write_atomic(path, json.dumps(result, indent=2))
+
+
+def merge_results(results_path: str, failures_path: str, count: int) -> Counter:
+    # Sums the shard result files and concatenates the shard failure queues into failures_path
+    totals = Counter()
+    missing = []
+
+    for index in range(count):
+        shard = (index, count)
+        try:
+            with open(shard_path(results_path, shard)) as file:
+                totals.update(json.load(file))
+        except (OSError, ValueError) as e:
+            missing.append(index)
+            log.error(f"No result for shard {index}/{count}: {repr(e)}")
+
+    os.makedirs(os.path.dirname(failures_path) or '.', exist_ok=True)
+    with open(failures_path, 'w') as merged:
+        for index in range(count):
+            path = shard_path(failures_path, (index, count))
+            if os.path.exists(path):
+                with open(path) as file:
+                    for line in file:
+                        merged.write(line)
+
+    totals['missing_shards'] = len(missing)
+    return totals
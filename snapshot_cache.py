@@ -0,0 +1,176 @@
+import logging
+import os
+import pickle
+import threading
+import time
+
+from typing import Callable
+from typing import List
+
+import utils.logger
+
+from columnar import ColumnarSnapshot
+from columnar import write_columnar
+from storage import write_atomic
+
+
+log = logging.getLogger(__name__)
+
+# Bump when the on-disk layout below changes
+FORMAT_VERSION = 1
+
+# ============================================================
+# SNAPSHOT
+# Only the projected fields are stored, one tuple per record
+# ============================================================
+
+class Snapshot:
+
+    def __init__(self, fields: List[str], records: list, created: float):
+        self.fields = fields
+        self.records = records
+        self.created = created
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def column(self, field: str) -> list:
+        index = self.fields.index(field)
+        return [record[index] for record in self.records]
+
+    def dicts(self) -> List[dict]:
+        return [dict(zip(self.fields, record)) for record in self.records]
+
+
+# ============================================================
+# SNAPSHOT CACHE
+# cache/<name>.snapshot stamped with format and dataset versions
+# and the projected field list. A snapshot older than ttl seconds,
+# or written with other versions/fields, is reloaded from loader.
+# With columnar=True it is cache/<name>.columns instead, memory
+# mapped on read (see columnar.py).
+# ============================================================
+
+class SnapshotCache:
+
+    def __init__(self, name: str, loader: Callable, fields: List[str], ttl: int, version: int = 1, directory: str = 'cache', columnar: bool = False):
+        self.name = name
+        self.loader = loader
+        self.fields = list(fields)
+        self.ttl = ttl
+        self.version = version
+        self.columnar = columnar
+        self.path = os.path.join(directory, f"{name}.columns" if columnar else f"{name}.snapshot")
+
+        self.lock = threading.Lock()
+        self.snapshot = None
+
+    def stamp(self) -> dict:
+        return {'format': FORMAT_VERSION, 'version': self.version, 'fields': self.fields}
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return None
+
+        if self.columnar:
+            return self.read_columnar()
+
+        try:
+            with open(self.path, 'rb') as file:
+                payload = pickle.load(file)
+        except Exception as e:
+            log.warning(f"Ignoring unreadable {self.name} cache: {repr(e)}")
+            return None
+
+        if payload.get('stamp') != self.stamp():
+            log.info(f"Ignoring {self.name} cache written with a different version or fields")
+            return None
+
+        return Snapshot(self.fields, payload['records'], payload['created'])
+
+    def read_columnar(self):
+        try:
+            snapshot = ColumnarSnapshot(self.path)
+        except Exception as e:
+            log.warning(f"Ignoring unreadable {self.name} cache: {repr(e)}")
+            return None
+
+        if snapshot.stamp != self.stamp():
+            log.info(f"Ignoring {self.name} cache written with a different version or fields")
+            return None
+
+        return snapshot
+
+    def is_fresh(self, snapshot: Snapshot) -> bool:
+        return time.time() - snapshot.created < self.ttl
+
+    def project(self, documents: list) -> list:
+        return [tuple(document.get(field) for field in self.fields) for document in documents]
+
+    def refresh(self) -> Snapshot:
+        log.info(f"Refreshing {self.name} cache")
+        snapshot = Snapshot(self.fields, self.project(self.loader()), time.time())
+        self.store(snapshot)
+
+        log.info(f"Cached {len(snapshot)} {self.name} records")
+        return snapshot
+
+    def apply_changes(self, changes: List[tuple], key: Callable) -> Snapshot:
+        # Applies ('upsert' | 'delete', document) changes in order, so the last one for a record wins, to the
+        # stored snapshot and marks it fresh without reloading the dataset.
+        # key maps a (possibly partial) document to the identity of its record
+        with self.lock:
+            snapshot = self.snapshot
+        if snapshot is None:
+            snapshot = self.read()
+        if snapshot is None:
+            return self.refresh()
+
+        records = {key(dict(zip(self.fields, record))): record for record in snapshot}
+        for kind, document in changes:
+            if kind == 'delete':
+                records.pop(key(document), None)
+            else:
+                (record,) = self.project([document])
+                records[key(dict(zip(self.fields, record)))] = record
+
+        updated = Snapshot(self.fields, list(records.values()), time.time())
+        self.store(updated)
+
+        log.info(f"Applied {len(changes)} changes to {self.name} records")
+        return updated
+
+    def store(self, snapshot: Snapshot):
+        if self.columnar:
+            write_columnar(self.path, self.stamp(), snapshot.created, self.fields, snapshot.records)
+        else:
+            payload = {'stamp': self.stamp(), 'created': snapshot.created, 'records': snapshot.records}
+            write_atomic(self.path, pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))
+
+        with self.lock:
+            self.snapshot = snapshot
+
+    def load(self) -> Snapshot:
+        with self.lock:
+            snapshot = self.snapshot
+
+        if snapshot is None:
+            snapshot = self.read()
+
+        if snapshot is not None and self.is_fresh(snapshot):
+            with self.lock:
+                self.snapshot = snapshot
+            return snapshot
+
+        try:
+            return self.refresh()
+        except Exception as e:
+            if snapshot is None:
+                raise
+
+            age = int(time.time() - snapshot.created)
+            log.error(f"Could not refresh {self.name} cache, using {age}s old snapshot: {repr(e)}")
+            return snapshot
@@ -0,0 +1,230 @@
+import logging
+import os
+import time
+
+from types import SimpleNamespace
+from typing import Iterator
+from typing import List
+
+import planon
+
+from sqlalchemy import Column
+from sqlalchemy import Float
+from sqlalchemy import Index
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import String
+from sqlalchemy import Table
+from sqlalchemy import and_
+from sqlalchemy import create_engine
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+import utils.logger
+
+from asset_resolver import chunked
+from concurrency import planon_limiter
+from metrics import metrics
+
+
+log = logging.getLogger(__name__)
+
+default_url = 'sqlite:///cache/staging.db'
+
+# Rows per INSERT batch while syncing
+batch_size = 1000
+
+# Records per Planon find while syncing
+page_size = int(os.environ.get('PLN_STAGING_PAGE_SIZE', 5000))
+
+# ============================================================
+# SCHEMA
+# Column names are the Planon field names, so mapping fields
+# can be read straight off the staged rows
+# ============================================================
+
+metadata = MetaData()
+
+usrmeassets = Table(
+    'planon_usrmeasset', metadata,
+    Column('Syscode', Integer, primary_key=True),
+    Column('Code', String, index=True),
+    Column('AssetTag', String, index=True),
+    Column('Name', String),
+    Column('LegacyDescription', String),
+    Column('Dossier', String),
+    Column('PropertyRef', Integer, index=True),
+    Column('SpaceRef', Integer),
+)
+
+properties = Table(
+    'planon_property', metadata,
+    Column('Syscode', Integer, primary_key=True),
+    Column('Code', String, index=True),
+)
+
+spaces = Table(
+    'planon_space', metadata,
+    Column('Syscode', Integer, primary_key=True),
+    Column('Code', String),
+    Column('PropertyRef', Integer, index=True),
+    Index('ix_planon_space_property_code', 'PropertyRef', 'Code'),
+)
+
+item_groups = Table(
+    'planon_itemgroup', metadata,
+    Column('Syscode', Integer, primary_key=True),
+    Column('Code', String, index=True),
+    Column('Name', String),
+)
+
+syncs = Table(
+    'staging_sync', metadata,
+    Column('resource', String, primary_key=True),
+    Column('records', Integer),
+    Column('synced_at', Float),
+)
+
+tables = {
+    'UsrMEAsset': usrmeassets,
+    'Property': properties,
+    'Space': spaces,
+    'ItemGroup': item_groups,
+}
+
+
+def get_engine(url: str = None) -> Engine:
+    url = url or os.environ.get('STAGING_DATABASE_URL', default_url)
+    if url.startswith('sqlite:///'):
+        os.makedirs(os.path.dirname(url[len('sqlite:///'):]) or '.', exist_ok=True)
+
+    engine = create_engine(url)
+    metadata.create_all(engine)
+    return engine
+
+
+# ============================================================
+# SYNC
+# Mirrors whole Planon resources into the staging tables, one
+# transaction per resource so readers never see a partial table
+# ============================================================
+
+def staged_value(column: Column, value):
+    if value is None:
+        return None
+    return int(value) if isinstance(column.type, Integer) else str(value)
+
+
+def page_query(after, size: int) -> dict:
+    # Keyset paging on Syscode, the SDK query keys assumed here are "sort", "limit" and a "gt" filter
+    query = {"sort": ["Syscode"], "limit": size}
+    if after is not None:
+        query["filter"] = {"Syscode": {"gt": after}}
+    return query
+
+
+def read_resource(resource_name: str, table: Table, size: int = None) -> Iterator[List[dict]]:
+    # Yields one page of staged rows per find, so a resource is never held in memory whole
+    size = size or page_size
+    after = None
+
+    while True:
+        with planon_limiter.slot(), metrics.time('staging_find', f"planon {resource_name}.find"):
+            records = getattr(planon, resource_name).find(page_query(after, size))
+
+        if not records:
+            return
+
+        last = max(record.Syscode for record in records)
+        if after is not None and last <= after:
+            raise RuntimeError(f"Planon {resource_name}.find ignored the Syscode page filter")
+
+        yield [{column.name: staged_value(column, getattr(record, column.name, None)) for column in table.columns} for record in records]
+
+        if len(records) < size:
+            return
+        after = last
+
+
+def sync_resource(engine: Engine, resource_name: str) -> int:
+    table = tables[resource_name]
+    count = 0
+
+    with engine.begin() as connection:
+        connection.execute(table.delete())
+        for page in read_resource(resource_name, table):
+            for batch in chunked(page, batch_size):
+                with metrics.time('staging_insert'):
+                    connection.execute(table.insert(), batch)
+                count += len(batch)
+
+        connection.execute(syncs.delete().where(syncs.c.resource == resource_name))
+        connection.execute(syncs.insert(), {'resource': resource_name, 'records': count, 'synced_at': time.time()})
+
+    log.info(f"Staged {count} Planon {resource_name} records")
+    return count
+
+
+def sync(engine: Engine, resource_names: List[str] = None) -> dict:
+    return {resource_name: sync_resource(engine, resource_name) for resource_name in resource_names or tables}
+
+
+# ============================================================
+# READ
+# ============================================================
+
+def location_records(engine: Engine) -> tuple:
+    # (Code, Syscode) properties and (Code, PropertyRef, Syscode) spaces, the shape LocationIndex.load_snapshot takes
+    with engine.connect() as connection:
+        property_records = [tuple(record) for record in connection.execute(select(properties.c.Code, properties.c.Syscode))]
+        space_records = [tuple(record) for record in connection.execute(select(spaces.c.Code, spaces.c.PropertyRef, spaces.c.Syscode))]
+
+    return property_records, space_records
+
+
+class StagedAssetResolver:
+    # Matches a chunk of CSV rows to staged UsrMEAssets with one join,
+    # the rows go into a temporary table on a connection held for the run
+
+    def __init__(self, engine: Engine, match: dict):
+        self.engine = engine
+        self.match = match
+        self.connection = None
+
+        self.rows = Table(
+            'staged_rows', MetaData(),
+            Column('position', Integer, primary_key=True),
+            *[Column(field, String) for field in match],
+            prefixes=['TEMPORARY'],
+        )
+        self.query = (
+            select(self.rows.c.position, *usrmeassets.columns)
+            .join(usrmeassets, and_(*(usrmeassets.c[field] == self.rows.c[field] for field in match)))
+        )
+
+    def __enter__(self):
+        self.connection = self.engine.connect()
+        self.rows.create(self.connection)
+        return self
+
+    def __exit__(self, *exc):
+        self.connection.rollback()
+        self.connection.close()
+
+    def resolve(self, rows: list) -> List[list]:
+        # One list of matching assets per row, in input order
+        matches = [[] for _ in rows]
+        if not rows:
+            return matches
+
+        with metrics.time('staging_join'):
+            self.connection.execute(self.rows.delete())
+            self.connection.execute(self.rows.insert(), [
+                {'position': position, **{field: row[column] for field, column in self.match.items()}}
+                for position, row in enumerate(rows)
+            ])
+
+            for record in self.connection.execute(self.query).mappings():
+                matches[record['position']].append(SimpleNamespace(**{column.name: record[column.name] for column in usrmeassets.columns}))
+
+        return matches
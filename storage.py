@@ -0,0 +1,20 @@
+import os
+import tempfile
+
+# ============================================================
+# FUNCTIONS
+# ============================================================
+
+def write_atomic(path: str, data):
+    # Readers see either the old file or the complete new one, never a partial write
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(descriptor, 'wb' if isinstance(data, bytes) else 'w') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
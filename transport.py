@@ -0,0 +1,144 @@
+import logging
+import random
+import re
+import threading
+
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import utils.logger
+
+from metrics import metrics
+
+
+log = logging.getLogger(__name__)
+
+# Defaults for every session, (connect, read) seconds
+default_timeout = (10, 120)
+default_pool_size = 16
+default_retries = 5
+default_backoff = 0.5
+
+# Planon and Dartmouth throttle with 429 and fail over with 5xx
+retry_statuses = (429, 500, 502, 503, 504)
+
+# POST creates are not idempotent and are left to the caller
+retry_methods = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+# Every SOAP call is a POST, the find / read operations sent through use_for_soap are read-only
+soap_retry_methods = retry_methods | {'POST'}
+
+sessions = {}
+sessions_lock = threading.Lock()
+
+# ============================================================
+# RETRY
+# Exponential backoff with full jitter, so concurrent workers
+# that hit the same 429 do not retry in lockstep
+# ============================================================
+
+class JitterRetry(Retry):
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff else 0
+
+
+# ============================================================
+# SESSION
+# ============================================================
+
+class TimeoutSession(requests.Session):
+
+    def __init__(self, timeout=default_timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def create_adapter(pool_size: int = default_pool_size, retries: int = default_retries, backoff: float = default_backoff, methods=retry_methods) -> HTTPAdapter:
+    retry = JitterRetry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=retry_statuses,
+        allowed_methods=methods,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    return HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+
+
+def count_response(name: str):
+    # Response hook feeding per-endpoint call, byte and error counters, numeric path segments are collapsed
+    def hook(response, *args, **kwargs):
+        path = re.sub(r'/\d+', '/:id', urlparse(response.url).path)
+        metrics.count(f"{name} {response.request.method} {path}", size=len(response.content or b''), error=response.status_code >= 400)
+        return response
+    return hook
+
+
+def get_session(name: str, pool_size: int = default_pool_size, timeout=default_timeout, params: dict = None, methods=retry_methods) -> TimeoutSession:
+    # One keep-alive session per API, shared by every caller and thread
+    with sessions_lock:
+        session = sessions.get(name)
+        if session is None:
+            log.debug(f"Setting up {name} HTTP session")
+            session = TimeoutSession(timeout=timeout)
+            session.hooks['response'].append(count_response(name))
+            adapter = create_adapter(pool_size=pool_size, methods=methods)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            sessions[name] = session
+
+        if params:
+            session.params = params
+
+    return session
+
+
+def use_for_soap(service, name: str = 'planon-soap', pool_size: int = default_pool_size, timeout=default_timeout):
+    # libplanon hands out zeep service proxies, route their transport through a shared session
+    transport = getattr(getattr(service, '_client', None), 'transport', None)
+    if transport is None:
+        log.debug("SOAP service does not expose a zeep transport, leaving it as is")
+        return
+
+    # Its own session, so only SOAP traffic gets POST retries on 429 / 5xx
+    transport.session = get_session(name, pool_size=pool_size, timeout=timeout, methods=soap_retry_methods)
+    transport.load_timeout = timeout[1]
+    transport.operation_timeout = timeout[1]
+
+
+# ============================================================
+# STATISTICS
+# ============================================================
+
+def connection_stats() -> dict:
+    # Connections opened vs requests sent per session, requests / connections is the reuse factor
+    stats = {}
+    with sessions_lock:
+        for name, session in sessions.items():
+            connections = 0
+            requests_sent = 0
+            for adapter in set(session.adapters.values()):
+                for key in list(adapter.poolmanager.pools.keys()):
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is None:
+                        continue
+                    connections += pool.num_connections
+                    requests_sent += pool.num_requests
+
+            stats[name] = {'connections': connections, 'requests': requests_sent}
+
+    return stats
+
+
+def log_connection_stats():
+    for name, stats in connection_stats().items():
+        log.info(f"HTTP {name} : {stats['requests']} requests over {stats['connections']} connections")